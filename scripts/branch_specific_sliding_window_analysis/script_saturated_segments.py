@@ -0,0 +1,231 @@
+import pandas as pd
+import numpy as np
+import sys
+import os
+from typing import NamedTuple
+
+# Add the root directory (scripts) to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.script_handle_satute_components import (
+    get_dataset_directories,
+)
+
+from utils.script_satute_run import (
+    get_satute_run,
+)
+
+
+# Thresholds of the SatuTe results (.satute.csv) a window z-score is compared to
+SEGMENT_THRESHOLDS = ["z_alpha", "z_alpha_bonferroni_corrected"]
+
+SEGMENT_COLUMNS = ["dataset", "branch", "threshold", "threshold_value", "start", "end", "min_zscore", "mean_zscore"]
+
+
+def find_segments_below_threshold(window_scores, threshold):
+    """
+    Finds the maximal runs of window z-scores below a threshold by run-length encoding.
+
+    Missing z-scores (NaN) are never below the threshold.
+
+    Args:
+        window_scores (np.ndarray): Window z-score track of one branch.
+        threshold (float): The threshold.
+
+    Returns:
+        tuple: First and last position (inclusive) of every run, and the minimal and mean z-score of every run.
+    """
+    window_scores = np.asarray(window_scores, dtype=np.float64)
+    below = (window_scores < threshold).astype(np.int8)
+
+    # +1 where a run starts, -1 after it ends
+    edges = np.diff(np.concatenate(([0], below, [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([]), np.array([])
+
+    # reduceat over the run boundaries, the values between runs are discarded
+    boundaries = np.column_stack((starts, ends)).ravel()
+    padded_scores = np.append(window_scores, 0.0)
+    min_zscores = np.minimum.reduceat(padded_scores, boundaries)[::2]
+    mean_zscores = np.add.reduceat(padded_scores, boundaries)[::2] / (ends - starts)
+
+    return starts, ends - 1, min_zscores, mean_zscores
+
+
+def build_saturated_segment_table(sliding_window_df, thresholds, dataset, branch_sites=None):
+    """
+    Extracts the segments of every branch whose window z-scores fall below the SatuTe thresholds.
+
+    Args:
+        sliding_window_df (DataFrame): Window z-scores, one column per branch, as written by sliding_window_analysis.
+        thresholds (DataFrame): Thresholds per branch (index), one column per entry of SEGMENT_THRESHOLDS.
+        dataset (str): Name of the dataset.
+        branch_sites (dict, optional): Branch label to the site of every row of its track. If None,
+            the row positions are used as coordinates.
+
+    Returns:
+        DataFrame: The segments with the columns of SEGMENT_COLUMNS, sorted by start, end and branch.
+    """
+    segment_tables = []
+    for branch in sliding_window_df.columns:
+        if branch not in thresholds.index:
+            print(f"No thresholds found for branch {branch}.")
+            continue
+        window_scores = sliding_window_df[branch].to_numpy(dtype=np.float64)
+        sites = np.arange(len(window_scores)) if branch_sites is None else np.asarray(branch_sites[branch])
+
+        for threshold in SEGMENT_THRESHOLDS:
+            threshold_value = thresholds.loc[branch, threshold]
+            starts, ends, min_zscores, mean_zscores = find_segments_below_threshold(window_scores, threshold_value)
+            if len(starts) == 0:
+                continue
+            segment_tables.append(pd.DataFrame({
+                "dataset": dataset,
+                "branch": branch,
+                "threshold": threshold,
+                "threshold_value": threshold_value,
+                "start": sites[starts],
+                "end": sites[ends],
+                "min_zscore": min_zscores,
+                "mean_zscore": mean_zscores,
+            }))
+
+    if not segment_tables:
+        return pd.DataFrame(columns=SEGMENT_COLUMNS)
+    segments = pd.concat(segment_tables, ignore_index=True)
+    return segments.sort_values(by=["start", "end", "branch"], kind="stable").reset_index(drop=True)
+
+
+""" Interval index for segment queries """
+
+class SegmentIndex(NamedTuple):
+    """
+    Segments sorted by their start together with the arrays used to query them.
+
+    Attributes:
+        segments (DataFrame): The segments, sorted by start.
+        starts (np.ndarray): Start of every segment.
+        ends (np.ndarray): End (inclusive) of every segment.
+        max_length (int): Length of the longest segment, bounds the starts of the segments overlapping a query.
+    """
+    segments: pd.DataFrame
+    starts: np.ndarray
+    ends: np.ndarray
+    max_length: int
+
+
+def build_segment_index(segments):
+    segments = segments.sort_values(by=["start", "end", "branch"], kind="stable").reset_index(drop=True)
+    starts = segments["start"].to_numpy(dtype=np.int64)
+    ends = segments["end"].to_numpy(dtype=np.int64)
+    max_length = int((ends - starts).max()) if len(segments) else 0
+    return SegmentIndex(segments, starts, ends, max_length)
+
+
+def query_segments(segment_index, start, end, threshold=None):
+    """
+    Returns the segments overlapping the sites start to end (inclusive).
+
+    Only the segments starting between start - max_length and end can overlap, they are found by binary search.
+
+    Args:
+        segment_index (SegmentIndex): The index, see build_segment_index.
+        start (int): First site of the query.
+        end (int): Last site of the query.
+        threshold (str, optional): Only return segments below this threshold, e.g. "z_alpha". If None, all thresholds.
+
+    Returns:
+        DataFrame: The overlapping segments, sorted by start.
+    """
+    first = np.searchsorted(segment_index.starts, start - segment_index.max_length, side="left")
+    last = np.searchsorted(segment_index.starts, end, side="right")
+    candidates = np.arange(first, last)
+    candidates = candidates[segment_index.ends[candidates] >= start]
+
+    segments = segment_index.segments.iloc[candidates]
+    if threshold is not None:
+        segments = segments[segments["threshold"] == threshold]
+    return segments
+
+
+""" Post-processing of the sliding window analysis """
+
+def get_branch_thresholds(directory_path, dataset_name):
+    # The thresholds of a branch may differ between rate categories, take the most conservative
+    zscore_data = get_satute_run(directory_path).get_zscore_data(dataset_name)
+    return zscore_data.groupby("branch", observed=True)[SEGMENT_THRESHOLDS].max()
+
+
+def saturated_segment_analysis(satute_input_dir, results_dir, window_size, data_name=None, kernel=None):
+    """
+    Builds the saturated segment table from the results of sliding_window_analysis.
+
+    The window z-score tracks are read from <dataset>_sliding_window_size_<window_size>.csv and their rows are
+    mapped to site coordinates through <data_name>_summarized_component_data.csv in results_dir. The thresholds
+    are taken from the .satute.csv files. The segments are saved as
+    <data_name>_saturated_segments_window_size_<window_size>.csv in results_dir.
+
+    Args:
+        satute_input_dir (str): Directory with the SatuTe output, optionally one subfolder per dataset.
+        results_dir (str): Directory with the results of sliding_window_analysis.
+        window_size (int): Window size of the sliding window analysis.
+        data_name (str, optional): Name of the summary file. If None, the name of satute_input_dir is used.
+        kernel (str, optional): Window kernel of the sliding window analysis. Default is None.
+
+    Returns:
+        SegmentIndex: The index of the segments.
+    """
+    if data_name is None:
+        data_name = os.path.basename(satute_input_dir)
+    kernel_suffix = "" if kernel is None else f"_{kernel}"
+
+    # Site of every row of the window tracks
+    component_data = pd.read_csv(
+        os.path.join(results_dir, f"{data_name}_summarized_component_data.csv"),
+        usecols=["dataset", "branch", "site"], dtype={"dataset": str, "branch": str},
+    )
+    sites_per_dataset = {}
+    for (dataset, branch), sites in component_data.groupby(["dataset", "branch"], sort=False, observed=True)["site"]:
+        sites_per_dataset.setdefault(dataset, {})[branch] = sites.to_numpy()
+
+    directories = get_dataset_directories(satute_input_dir)
+
+    segment_tables = []
+    for dataset, directory in directories:
+        sliding_window_csv_path = os.path.join(results_dir, f"{dataset}_sliding_window_size_{window_size}{kernel_suffix}.csv")
+        if not os.path.isfile(sliding_window_csv_path) or dataset not in sites_per_dataset:
+            continue
+
+        sliding_window_df = pd.read_csv(sliding_window_csv_path)
+        thresholds = get_branch_thresholds(directory, dataset)
+        segment_tables.append(
+            build_saturated_segment_table(sliding_window_df, thresholds, dataset, sites_per_dataset[dataset])
+        )
+
+    segments = pd.concat(segment_tables, ignore_index=True) if segment_tables else pd.DataFrame(columns=SEGMENT_COLUMNS)
+    segment_index = build_segment_index(segments)
+
+    csv_file_path = os.path.join(results_dir, f"{data_name}_saturated_segments_window_size_{window_size}{kernel_suffix}.csv")
+    segment_index.segments.to_csv(csv_file_path, index=False)
+    print(f"Saturated segments have been saved to {csv_file_path}")
+
+    return segment_index
+
+
+if __name__ == "__main__":
+
+    # Get the current working directory
+    current_directory = os.getcwd()
+
+    # Specify the path to your considered input data and to the results of the sliding window analysis
+    input_dir = os.path.join(current_directory, "../../example/SatuTe_without_rate_heterogeneity")
+    results_dir = os.path.join(current_directory, "../../example/results_sliding_window_analysis/example_specific_branches")
+
+    segment_index = saturated_segment_analysis(input_dir, results_dir, window_size=36)
+
+    # All branches whose signal drops below the Bonferroni corrected threshold in sites 200 to 400
+    segments = query_segments(segment_index, 200, 400, threshold="z_alpha_bonferroni_corrected")
+    print(segments["branch"].unique())
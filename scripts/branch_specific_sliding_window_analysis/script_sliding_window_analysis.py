@@ -1,7 +1,10 @@
 import pandas as pd
 import numpy as np
+import csv
 import sys
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 # Add the root directory (scripts) to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -9,7 +12,40 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from utils.script_handle_satute_components import (
     calculate_variance, 
+    get_dataset_directories,
+    iter_branch_data,
+    stream_component_data,
     summarize_component_data,
+    write_summarized_component_data,
+)
+
+from utils.script_satute_run import (
+    get_satute_run,
+)
+
+from utils.script_handle_data import (
+    iter_branch_records,
+    list_satute_files,
+    load_branch_offset_index,
+)
+
+from utils.script_window_kernels import (
+    FFT_WINDOW_THRESHOLD,
+    convolve_windows_fft,
+    get_window_kernel,
+)
+
+from utils.script_coherence_matrix import (
+    get_branch_present_sites,
+    get_coherence_matrix,
+    get_rank_matrix,
+    get_site_axis,
+    select_branches,
+)
+
+from branch_specific_sliding_window_analysis.script_window_pyramid import (
+    get_window_pyramid_path,
+    write_window_pyramid,
 )
 
 def calculate_window_zscore(window_data,variance):
@@ -19,7 +55,7 @@ def calculate_window_zscore(window_data,variance):
     return weighted_average/np.sqrt(variance/window_size)
 
 
-def calculate_window_zscores_per_branch( component_dataframe, window_size): 
+def calculate_window_zscores_per_branch( component_dataframe, window_size, kernel=None): 
 
     unique_branches = component_dataframe['branch'].unique()
     if len(unique_branches) != 1:
@@ -28,57 +64,272 @@ def calculate_window_zscores_per_branch( component_dataframe, window_size):
 
     data = np.array(component_dataframe['coherence'])
     variance = calculate_variance(component_dataframe)
-    window_score = pd.Series(data).rolling(window=window_size).apply(lambda x: calculate_window_zscore(x, variance), raw=True)
-    
-    # Shift the results to align them to the middle of the window
-    middle_position_shift = -(window_size // 2)
-    window_score_centered = window_score.shift(middle_position_shift)
+    window_score_centered = calculate_window_zscores(data, variance, window_size, kernel=kernel)
     
     return window_score_centered, variance
-         
 
-def sliding_window_analysis(satute_input_dir, window_size, edge_list=None, results_dir=None, data_name =None):
+
+def calculate_window_zscores(data, variance, window_size, chunk_size=65536, kernel=None):
+    """
+    Computes the centered sliding-window z-scores of a coherence track.
+
+    Vectorized equivalent of rolling(window_size).apply(calculate_window_zscore): every window is
+    weighted with the same linearly decreasing kernel, computed once, and the windows are
+    evaluated in chunks of chunk_size. The results are numerically identical.
+
+    Args:
+        data (np.ndarray): Coherence coefficients of one branch in site order.
+        variance (float): Variance of the branch.
+        window_size (int): Number of sites per window.
+        chunk_size (int, optional): Number of windows evaluated at once. Default is 65536.
+        kernel (str, optional): Window kernel, see utils.script_window_kernels. If None, the
+            linearly decreasing weights of calculate_window_zscore are used.
+
+    Returns:
+        pd.Series: The window z-scores, shifted to the middle of the window.
+    """
+    # rolling works on float64 values
+    data = np.asarray(data, dtype=np.float64)
+    window_score_centered = calculate_window_zscore_matrix(data[np.newaxis, :], np.array([variance]), window_size, chunk_size, kernel)
+
+    return pd.Series(window_score_centered[0])
+
+
+def calculate_window_zscore_matrix(coherence, variances, window_size, chunk_size=65536, kernel=None):
+    """
+    Computes the centered sliding-window z-scores of several branches at once.
+
+    Every row of coherence is the coherence track of one branch, shorter tracks padded with NaN
+    at the end. The result of each row is identical to calculate_window_zscores of its track,
+    padded with NaN.
+
+    Without a kernel, the windows are weighted as in calculate_window_zscore and normalised by the
+    window size. A named kernel is normalised by its effective size sum(w)^2 / sum(w^2), and windows
+    larger than FFT_WINDOW_THRESHOLD are then evaluated by FFT convolution.
+
+    Args:
+        coherence (np.ndarray): Coherence coefficients, one row per branch and one column per site rank.
+        variances (np.ndarray): Variance of each branch.
+        window_size (int): Number of sites per window.
+        chunk_size (int, optional): Number of windows evaluated at once over all branches. Default is 65536.
+        kernel (str, optional): Window kernel, see utils.script_window_kernels. Default is None.
+
+    Returns:
+        np.ndarray: The window z-scores (branch x site rank), shifted to the middle of the window.
+    """
+    coherence = np.asarray(coherence, dtype=np.float64)
+    number_of_branches, number_of_sites = coherence.shape
+    if kernel is None:
+        weights = np.linspace(1, 0.5, window_size)  # Linearly decreasing weights
+        effective_size = window_size
+    else:
+        weights, effective_size = get_window_kernel(kernel, window_size)
+    weights_sum = weights.sum()
+    standard_errors = np.sqrt(np.asarray(variances, dtype=np.float64)/effective_size)[:, np.newaxis]
+
+    window_score = np.full(coherence.shape, np.nan)
+    if number_of_sites >= window_size and number_of_branches > 0 and kernel is not None and window_size > FFT_WINDOW_THRESHOLD:
+        # Direct summation costs window_size operations per site
+        weighted_average = convolve_windows_fft(coherence, weights) / weights_sum
+        window_score[:, window_size - 1:] = weighted_average / standard_errors
+    elif number_of_sites >= window_size and number_of_branches > 0:
+        windows = np.lib.stride_tricks.sliding_window_view(coherence, window_size, axis=1)
+        windows_per_chunk = max(1, chunk_size // number_of_branches)
+        for start in range(0, windows.shape[1], windows_per_chunk):
+            chunk = windows[:, start:start + windows_per_chunk]
+            # Same operations as np.average, windows containing NaN stay NaN
+            weighted_average = np.multiply(chunk, weights).sum(axis=2) / weights_sum
+            end = start + chunk.shape[1]
+            window_score[:, window_size - 1 + start:window_size - 1 + end] = weighted_average / standard_errors
+
+    # Shift the results to align them to the middle of the window
+    middle_position_shift = window_size // 2
+    window_score_centered = np.full(coherence.shape, np.nan)
+    if middle_position_shift < number_of_sites:
+        window_score_centered[:, :number_of_sites - middle_position_shift] = window_score[:, middle_position_shift:]
+
+    return window_score_centered
+
+
+def calculate_window_zscores_all_branches(matrix, window_size, edge_list=None, kernel=None):
+    """
+    Computes the centered sliding-window z-scores of all branches of one dataset at once.
+
+    The coherence coefficients of the memory-mapped coherence matrix are arranged as a branch x site
+    rank matrix, see utils.script_coherence_matrix.get_rank_matrix, and the window kernel is applied
+    along the sites of all branches together. The results are identical to
+    calculate_window_zscores_per_branch for every branch.
+
+    Args:
+        matrix (CoherenceMatrix): The coherence matrix of the dataset, see utils.script_coherence_matrix.get_coherence_matrix.
+        window_size (int): Number of sites per window.
+        edge_list (list, optional): List of branches to include. If None, include all branches.
+        kernel (str, optional): Window kernel, see utils.script_window_kernels. Default is None.
+
+    Returns:
+        tuple: The branch labels in sorted order, their window z-scores (branch x site rank)
+        and their variances.
+    """
+    branches, coherence, present, variances = select_branches(matrix, edge_list)
+    window_scores = calculate_window_zscore_matrix(get_rank_matrix(coherence, present), variances, window_size, kernel=kernel)
+
+    return branches, window_scores, variances
+
+
+def get_branch_sites(matrix, branches):
+    # Site of every value of the window track of a branch
+    return {branch: get_branch_present_sites(matrix, branch) for branch in branches}
+
+
+def sliding_window_analysis_of_dataset(dataset, directory, window_size, edge_list=None, results_dir=None, kernel=None, pyramid=False):
+    """
+    Runs the sliding window analysis of one dataset end to end: ingest, variances, window z-scores and CSV.
+
+    Defined at module level so that it can run in a worker process, see the workers option of sliding_window_analysis.
+
+    Args:
+        dataset (str): Name of the dataset.
+        directory (str): Directory with the SatuTe output of the dataset.
+        window_size (int): Number of sites per window.
+        edge_list (list, optional): List of branches to include. If None, include all branches.
+        results_dir (str, optional): Output directory. If None, directory is used.
+        kernel (str, optional): Window kernel, see utils.script_window_kernels. Default is None.
+        pyramid (bool, optional): Also write the multi-resolution store of the window tracks. Default is False.
+
+    Returns:
+        tuple: The dataset name, its component data sorted by branch and site, and its global variance records.
+    """
+    if results_dir is None:
+        results_dir = directory
+
+    # Not kept by the run, a worker process handles many datasets
+    component_data = get_satute_run(directory).get_component_data(dataset, edge_list=edge_list, memoize=False)
+    if component_data.empty:
+        return dataset, component_data, []
+
+    # All branches at once from the memory-mapped matrix, identical to the per-branch computation
+    matrix = get_coherence_matrix(directory, results_dir, dataset, component_data=component_data if edge_list is None else None)
+    branches, window_scores, variances = calculate_window_zscores_all_branches(matrix, window_size, edge_list, kernel)
+    if not branches:
+        return dataset, component_data, []
+
+    order = sorted(range(len(branches)), key=lambda index: branches[index])
+    sliding_window_df = pd.DataFrame(window_scores[order].T, columns=[branches[index] for index in order])
+
+    kernel_suffix = "" if kernel is None else f"_{kernel}"
+    sliding_window_csv_path = os.path.join(results_dir, f"{dataset}_sliding_window_size_{window_size}{kernel_suffix}.csv")
+    sliding_window_df.to_csv(sliding_window_csv_path, index=False)
+    if pyramid:
+        write_window_pyramid(
+            get_window_pyramid_path(results_dir, dataset, window_size, kernel),
+            sliding_window_df, get_branch_sites(matrix, branches), window_size, dataset, kernel,
+        )
+
+    global_variance_list = [
+        {'dataset': dataset, 
+         'branch': branch, 
+         'global_variance': variance,
+        } for branch, variance in zip(branches, variances)]
+    return dataset, component_data, global_variance_list
+
+
+def sliding_window_analysis(satute_input_dir, window_size, edge_list=None, results_dir=None, data_name =None, streaming=False, batched=False, kernel=None, workers=None, pyramid=False):
     # If results_dir is None, use satute_input_dir
     if results_dir is None:
         results_dir = satute_input_dir
     if data_name is None: 
         data_name = os.path.basename(satute_input_dir)
 
-    ### Summarize all data of the coeherence coefficients per site in the directory
-    summarized_component_data_dict = summarize_component_data(satute_input_dir, results_dir, data_name)
     sliding_window_dict = {}
+    results_per_dataset = {}  # Dictionary to hold rolling results for each branch per dataset
+    sites_per_dataset = {}  # Site of every value of the window tracks, for the pyramid store
     global_variance_list = []
 
-    for dataset in summarized_component_data_dict.keys():
-        unique_branches = summarized_component_data_dict[dataset]['branch'].unique()
-        branch_results_dict = {}  # Dictionary to hold rolling results for each branch
-
-        for branch in unique_branches:
-            if edge_list is None or branch in edge_list:
-                # Filter the dataset for the current branch
-                branch_data = summarized_component_data_dict[dataset][summarized_component_data_dict[dataset]['branch'] == branch]
-
-                # Calculate custom rolling metric using the window size
-                window_score_centered, variance = calculate_window_zscores_per_branch(branch_data, window_size)
-
-                if not window_score_centered.empty:
-                    # Store the rolling centered data in the dictionary under the branch name
-                    branch_results_dict[branch] = window_score_centered
-                    # Also store the variance for that branch
-                    global_variance_list.append(
-                        {'dataset': dataset, 
-                         'branch': branch, 
-                         'global_variance': variance,
-                        })
-
-        if branch_results_dict:
-            # Convert the dictionary of rolling results into a DataFrame
-            sliding_window_df = pd.DataFrame(branch_results_dict)
-            sliding_window_dict[dataset] = sliding_window_df
-
-            # Save the sliding window results for the current dataset
-            sliding_window_csv_path = os.path.join(results_dir, f"{dataset}_sliding_window_size_{window_size}.csv")
-            sliding_window_df.to_csv(sliding_window_csv_path, index=False)
+    if workers is not None and not streaming:
+        # Every dataset end to end in its own worker process
+        summarized_component_data_dict = {}
+        directories = get_dataset_directories(satute_input_dir)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(sliding_window_analysis_of_dataset, dataset, directory, window_size, edge_list, results_dir, kernel, pyramid)
+                for dataset, directory in directories
+            ]
+            for future in futures:
+                dataset, component_data, dataset_variance_list = future.result()
+                if not component_data.empty:
+                    summarized_component_data_dict[dataset] = component_data
+                global_variance_list.extend(dataset_variance_list)
+
+        if summarized_component_data_dict:
+            write_summarized_component_data(summarized_component_data_dict, results_dir, data_name)
+        if global_variance_list:
+            global_variance_df = pd.DataFrame(global_variance_list)
+            csv_file_path = os.path.join(results_dir, f"{data_name}_global_variance.csv")
+            global_variance_df.to_csv(csv_file_path, index=False)
+        return
+
+    ### Summarize all data of the coeherence coefficients per site in the directory
+    if streaming:
+        # Read one branch at a time instead of holding all component data in memory
+        branch_data_iterator = stream_component_data(satute_input_dir, results_dir, data_name, edge_list)
+    else:
+        summarized_component_data_dict = summarize_component_data(satute_input_dir, results_dir, data_name, edge_list=edge_list)
+        branch_data_iterator = iter_branch_data(summarized_component_data_dict, edge_list)
+
+    if batched and not streaming:
+        # All branches of a dataset at once, from the memory-mapped coherence matrix of its directory
+        branch_data_iterator = []
+        directories = dict(get_dataset_directories(satute_input_dir))
+        for dataset, component_data in summarized_component_data_dict.items():
+            matrix = get_coherence_matrix(
+                directories[dataset], results_dir, dataset, component_data=component_data if edge_list is None else None
+            )
+            branches, window_scores, variances = calculate_window_zscores_all_branches(matrix, window_size, edge_list, kernel)
+            if not branches:
+                continue
+
+            order = sorted(range(len(branches)), key=lambda index: branches[index])
+            sliding_window_dict[dataset] = pd.DataFrame(
+                window_scores[order].T, columns=[branches[index] for index in order]
+            )
+            if pyramid:
+                sites_per_dataset[dataset] = get_branch_sites(matrix, branches)
+            global_variance_list.extend(
+                {'dataset': dataset, 
+                 'branch': branch, 
+                 'global_variance': variance,
+                } for branch, variance in zip(branches, variances))
+
+    for dataset, branch, branch_data in branch_data_iterator:
+        # Calculate custom rolling metric using the window size
+        window_score_centered, variance = calculate_window_zscores_per_branch(branch_data, window_size, kernel)
+
+        if not window_score_centered.empty:
+            # Store the rolling centered data in the dictionary under the branch name
+            results_per_dataset.setdefault(dataset, {})[branch] = window_score_centered
+            if pyramid:
+                sites_per_dataset.setdefault(dataset, {})[branch] = branch_data['site'].to_numpy()
+            # Also store the variance for that branch
+            global_variance_list.append(
+                {'dataset': dataset, 
+                 'branch': branch, 
+                 'global_variance': variance,
+                })
+
+    for dataset, branch_results_dict in results_per_dataset.items():
+        # Convert the dictionary of rolling results into a DataFrame, branches in sorted order
+        sliding_window_dict[dataset] = pd.DataFrame({branch: branch_results_dict[branch] for branch in sorted(branch_results_dict)})
+
+    kernel_suffix = "" if kernel is None else f"_{kernel}"
+    for dataset, sliding_window_df in sliding_window_dict.items():
+        # Save the sliding window results for the current dataset
+        sliding_window_csv_path = os.path.join(results_dir, f"{dataset}_sliding_window_size_{window_size}{kernel_suffix}.csv")
+        sliding_window_df.to_csv(sliding_window_csv_path, index=False)
+        if pyramid:
+            write_window_pyramid(
+                get_window_pyramid_path(results_dir, dataset, window_size, kernel),
+                sliding_window_df, sites_per_dataset[dataset], window_size, dataset, kernel,
+            )
 
     if global_variance_list:  # Check if global_variance_list is not empty
         # Convert the list of dictionaries into a DataFrame
@@ -89,6 +340,414 @@ def sliding_window_analysis(satute_input_dir, window_size, edge_list=None, resul
         global_variance_df.to_csv(csv_file_path, index=False)
 
 
+""" Windows over alignment sites """
+
+def calculate_site_indexed_window_zscore_matrix(coherence, mask, variances, window_size, chunk_size=65536, kernel=None, min_valid_sites=1):
+    """
+    Computes the centered window z-scores over alignment sites, skipping the sites missing in a window.
+
+    Every window covers window_size consecutive sites of the axis. The weighted sum of the valid sites
+    and the sum of their weights are two convolutions, of the masked values and of the mask, so the
+    weighted mean only uses the sites present. It is normalised by the actual number of valid sites
+    (without a kernel) or by the effective size of the valid weights (with a kernel). Without missing
+    sites, the results equal calculate_window_zscore_matrix.
+
+    Args:
+        coherence (np.ndarray): Coherence coefficients, one row per branch and one column per site.
+        mask (np.ndarray): True where a site of a branch is present.
+        variances (np.ndarray): Variance of each branch.
+        window_size (int): Number of sites per window.
+        chunk_size (int, optional): Number of windows evaluated at once over all branches. Default is 65536.
+        kernel (str, optional): Window kernel, see utils.script_window_kernels. Default is None.
+        min_valid_sites (int, optional): Windows with fewer valid sites are NaN. Default is 1.
+
+    Returns:
+        np.ndarray: The window z-scores (branch x site), shifted to the middle of the window.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    values = np.where(mask, coherence, 0.0)
+    number_of_branches, number_of_sites = values.shape
+    if kernel is None:
+        weights = np.linspace(1, 0.5, window_size)  # Linearly decreasing weights
+    else:
+        weights, _ = get_window_kernel(kernel, window_size)
+    squared_weights = np.square(weights)
+
+    window_score = np.full(values.shape, np.nan)
+    if number_of_sites < window_size or number_of_branches == 0:
+        return window_score
+
+    number_of_windows = number_of_sites - window_size + 1
+    # Exact number of valid sites per window from prefix sums
+    valid_prefix = np.concatenate((np.zeros((number_of_branches, 1), dtype=np.int64), np.cumsum(mask, axis=1)), axis=1)
+    valid_sites = valid_prefix[:, window_size:] - valid_prefix[:, :number_of_windows]
+
+    masked_weights = mask.astype(np.float64)
+    if kernel is not None and window_size > FFT_WINDOW_THRESHOLD:
+        weighted_sums = convolve_windows_fft(values, weights)
+        weight_sums = convolve_windows_fft(masked_weights, weights)
+        squared_weight_sums = convolve_windows_fft(masked_weights, squared_weights)
+    else:
+        value_windows = np.lib.stride_tricks.sliding_window_view(values, window_size, axis=1)
+        mask_windows = np.lib.stride_tricks.sliding_window_view(masked_weights, window_size, axis=1)
+        weighted_sums = np.empty((number_of_branches, number_of_windows))
+        weight_sums = np.empty((number_of_branches, number_of_windows))
+        squared_weight_sums = np.empty((number_of_branches, number_of_windows))
+        windows_per_chunk = max(1, chunk_size // number_of_branches)
+        for start in range(0, number_of_windows, windows_per_chunk):
+            end = min(start + windows_per_chunk, number_of_windows)
+            weighted_sums[:, start:end] = np.multiply(value_windows[:, start:end], weights).sum(axis=2)
+            weight_sums[:, start:end] = mask_windows[:, start:end] @ weights
+            squared_weight_sums[:, start:end] = mask_windows[:, start:end] @ squared_weights
+
+    valid_windows = valid_sites >= max(min_valid_sites, 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weighted_average = weighted_sums / weight_sums
+        if kernel is None:
+            # As in calculate_window_zscore, the number of sites in the window
+            effective_sizes = valid_sites.astype(np.float64)
+        else:
+            effective_sizes = np.square(weight_sums) / squared_weight_sums
+        standard_errors = np.sqrt(np.asarray(variances, dtype=np.float64)[:, np.newaxis] / effective_sizes)
+        window_score[:, window_size - 1:] = np.where(valid_windows, weighted_average / standard_errors, np.nan)
+
+    # Shift the results to align them to the middle of the window
+    middle_position_shift = window_size // 2
+    window_score_centered = np.full(values.shape, np.nan)
+    if middle_position_shift < number_of_sites:
+        window_score_centered[:, :number_of_sites - middle_position_shift] = window_score[:, middle_position_shift:]
+
+    return window_score_centered
+
+
+def site_indexed_sliding_window_analysis(satute_input_dir, window_size, edge_list=None, results_dir=None, data_name=None, kernel=None, min_valid_sites=1):
+    """
+    Sliding window analysis with windows over alignment sites instead of rows of the components files.
+
+    The results of every dataset are saved as <dataset>_sliding_window_size_<window_size>_site_indexed.csv
+    with a site column and one column per branch, so that the windows of all branches refer to the same
+    alignment columns. The variances are computed as in sliding_window_analysis.
+
+    Args:
+        satute_input_dir (str): Directory with the SatuTe output, optionally one subfolder per dataset.
+        window_size (int): Number of alignment sites per window.
+        edge_list (list, optional): List of branches to include. If None, include all branches.
+        results_dir (str, optional): Output directory. If None, satute_input_dir is used.
+        data_name (str, optional): Name of the summary files. If None, the name of satute_input_dir is used.
+        kernel (str, optional): Window kernel, see utils.script_window_kernels. Default is None.
+        min_valid_sites (int, optional): Windows with fewer sites present are NaN. Default is 1.
+
+    Returns:
+        dict: Dataset name to its window z-scores (DataFrame).
+    """
+    if results_dir is None:
+        results_dir = satute_input_dir
+    if data_name is None:
+        data_name = os.path.basename(satute_input_dir)
+
+    summarized_component_data_dict = summarize_component_data(satute_input_dir, results_dir, data_name, edge_list=edge_list)
+
+    kernel_suffix = "" if kernel is None else f"_{kernel}"
+    sliding_window_dict = {}
+    directories = dict(get_dataset_directories(satute_input_dir))
+    for dataset, component_data in summarized_component_data_dict.items():
+        matrix = get_coherence_matrix(
+            directories[dataset], results_dir, dataset, component_data=component_data if edge_list is None else None
+        )
+        branches, coherence, present, variances = select_branches(matrix, edge_list)
+        if not branches:
+            continue
+        window_scores = calculate_site_indexed_window_zscore_matrix(
+            coherence, present, variances, window_size, kernel=kernel, min_valid_sites=min_valid_sites
+        )
+
+        sliding_window_df = pd.DataFrame({'site': get_site_axis(matrix)})
+        for branch in sorted(branches):
+            sliding_window_df[branch] = window_scores[branches.index(branch)]
+        sliding_window_dict[dataset] = sliding_window_df
+
+        sliding_window_csv_path = os.path.join(results_dir, f"{dataset}_sliding_window_size_{window_size}{kernel_suffix}_site_indexed.csv")
+        sliding_window_df.to_csv(sliding_window_csv_path, index=False)
+
+    return sliding_window_dict
+
+
+""" Record streams with constant memory """
+
+def calculate_variance_from_category_counts(category_counts, category_variances):
+    """
+    Computes the variance of a branch from the number of its sites per rate category,
+    as calculate_variance does from the component data.
+
+    Args:
+        category_counts (dict): Rate category to the number of sites of the branch.
+        category_variances (dict): Rate category to its category variance.
+
+    Returns:
+        float: The variance of the branch.
+    """
+    sequence_len = sum(category_counts.values())
+    variance = 0
+    # Same summation order as calculate_variance (most frequent category first)
+    for category in sorted(category_counts, key=lambda category: (-category_counts[category], category)):
+        if category_counts[category] > 0:
+            variance += category_variances[category] * category_counts[category]/sequence_len
+    return variance
+
+
+def iter_window_zscores(records, variance, window_size, kernel=None):
+    """
+    Generator counterpart of calculate_window_zscores for records arriving in site order.
+
+    Only the last window_size coherence values are kept, in a ring buffer. The z-score of a site
+    is yielded as soon as the window centered on it is complete. Sites at the start and the end
+    without a complete window get NaN, exactly as in calculate_window_zscores.
+
+    Args:
+        records (iterable of tuple): (site, coherence, ...) records of one branch in site order,
+            e.g. (site, coherence, category).
+        variance (float): Variance of the branch, see calculate_variance_from_category_counts.
+        window_size (int): Number of sites per window.
+        kernel (str, optional): Window kernel, see utils.script_window_kernels. Default is None.
+
+    Yields:
+        tuple: Site and its centered window z-score.
+    """
+    if kernel is None:
+        weights = np.linspace(1, 0.5, window_size)  # Linearly decreasing weights
+        effective_size = window_size
+    else:
+        weights, effective_size = get_window_kernel(kernel, window_size)
+    weights_sum = weights.sum()
+    standard_error = np.sqrt(variance/effective_size)
+    middle_position_shift = window_size // 2
+
+    # Every value is stored twice, so the current window is always a contiguous slice
+    ring_buffer = np.full(2 * window_size, np.nan)
+    pending_sites = deque()
+    number_of_records = 0
+
+    for record in records:
+        site, coherence = record[0], record[1]
+        position = number_of_records % window_size
+        ring_buffer[position] = ring_buffer[position + window_size] = coherence
+        number_of_records += 1
+        pending_sites.append(site)
+
+        window_score = np.nan
+        if number_of_records >= window_size:
+            window = ring_buffer[position + 1:position + 1 + window_size]
+            # Same operations as calculate_window_zscore_matrix
+            window_score = np.multiply(window, weights).sum() / weights_sum / standard_error
+
+        # The window ending here is centered on the site middle_position_shift records back
+        if number_of_records > middle_position_shift:
+            yield pending_sites.popleft(), window_score
+
+    while pending_sites:
+        yield pending_sites.popleft(), np.nan
+
+
+def incremental_sliding_window_analysis(satute_input_dir, window_size, edge_list=None, results_dir=None, data_name=None, kernel=None):
+    """
+    Sliding window analysis for very long alignments, with memory independent of the alignment length.
+
+    Every branch is read twice from the components files through their branch index: once to count its
+    sites per rate category for the variance, once to stream its records through iter_window_zscores.
+    The z-scores are written while they are computed, in long format with the columns branch, site and
+    window_zscore, to <dataset>_sliding_window_size_<window_size>_long.csv. The variances are saved in
+    <data_name>_global_variance.csv as in sliding_window_analysis. The values are parsed exactly, while
+    pandas' default CSV parser may round the last digit differently, so the results can differ from
+    sliding_window_analysis in the last bits.
+
+    Args:
+        satute_input_dir (str): Directory with the SatuTe output, optionally one subfolder per dataset.
+        window_size (int): Number of sites per window.
+        edge_list (list, optional): List of branches to include. If None, include all branches.
+        results_dir (str, optional): Output directory. If None, satute_input_dir is used.
+        data_name (str, optional): Name of the variance file. If None, the name of satute_input_dir is used.
+        kernel (str, optional): Window kernel, see utils.script_window_kernels. Default is None.
+    """
+    if results_dir is None:
+        results_dir = satute_input_dir
+    if data_name is None: 
+        data_name = os.path.basename(satute_input_dir)
+
+    # Subfolders first, the satute_input_dir itself last, as in summarize_component_data
+    directories = get_dataset_directories(satute_input_dir)
+
+    kernel_suffix = "" if kernel is None else f"_{kernel}"
+    global_variance_list = []
+    for dataset, directory in directories:
+        file_paths = list_satute_files(directory, ".components.csv")
+        branches = sorted({branch for file_path in file_paths for branch in load_branch_offset_index(file_path)})
+        if edge_list is not None:
+            branches = [branch for branch in branches if branch in edge_list]
+        if not branches:
+            continue
+
+        sliding_window_csv_path = os.path.join(results_dir, f"{dataset}_sliding_window_size_{window_size}{kernel_suffix}_long.csv")
+        with open(sliding_window_csv_path, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["branch", "site", "window_zscore"])
+
+            for branch in branches:
+                # First pass: the variance depends on the number of sites per rate category
+                category_counts, category_variances = {}, {}
+                for site, coherence, category_variance, category in iter_branch_records(file_paths, branch):
+                    category_counts[category] = category_counts.get(category, 0) + 1
+                    category_variances.setdefault(category, category_variance)
+                variance = calculate_variance_from_category_counts(category_counts, category_variances)
+
+                # Second pass: stream the window z-scores to disk
+                for site, window_score in iter_window_zscores(iter_branch_records(file_paths, branch), variance, window_size, kernel):
+                    writer.writerow([branch, site, "" if np.isnan(window_score) else float(window_score)])
+
+                global_variance_list.append(
+                    {'dataset': dataset, 
+                     'branch': branch, 
+                     'global_variance': variance,
+                    })
+
+    if global_variance_list:
+        global_variance_df = pd.DataFrame(global_variance_list)
+        csv_file_path = os.path.join(results_dir, f"{data_name}_global_variance.csv")
+        global_variance_df.to_csv(csv_file_path, index=False)
+
+
+""" Sweep over several window sizes """
+
+# Window sizes below this are summed directly in the sweep, larger ones from chunk-local prefix sums
+SWEEP_DIRECT_WINDOW_THRESHOLD = 64
+
+
+def calculate_window_zscore_sweep(data, variance, window_sizes):
+    """
+    Computes the centered sliding-window z-scores of a coherence track for several window sizes at once.
+
+    Windows smaller than SWEEP_DIRECT_WINDOW_THRESHOLD are summed directly, see calculate_window_zscore_matrix.
+    For larger windows the weighted sums are taken from prefix sums of the coherence values and of the
+    coherence values times their position: with the linearly decreasing weights 1 - 0.5 * j / (w - 1),
+    the weighted sum of the window starting at site i is S0 - 0.5 / (w - 1) * (S1 - i * S0). Windows
+    containing NaN are NaN.
+
+    The prefix sums restart every 4 * w window starts, with the positions counted from the start of the
+    chunk. Prefix sums over the whole track grow with the square of its length and lose precision by
+    cancellation (differences of about 1e-5 at 400k sites); within chunks the relative difference to
+    calculate_window_zscores stays below 1e-12 independently of the track length.
+
+    Args:
+        data (np.ndarray): Coherence coefficients of one branch in site order.
+        variance (float): Variance of the branch.
+        window_sizes (iterable of int): The window sizes.
+
+    Returns:
+        np.ndarray: Window z-scores, one row per window size and one column per site, each row
+        shifted to the middle of its window.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    window_sizes = [int(window_size) for window_size in window_sizes]
+    number_of_sites = len(data)
+
+    missing = np.isnan(data)
+    values = np.where(missing, 0.0, data)
+    # Missing sites are counted exactly from an integer prefix sum
+    prefix_missing = np.concatenate(([0], np.cumsum(missing)))
+
+    window_scores = np.full((len(window_sizes), number_of_sites), np.nan)
+    for row, window_size in enumerate(window_sizes):
+        if window_size < 1 or number_of_sites < window_size:
+            continue
+        if window_size < SWEEP_DIRECT_WINDOW_THRESHOLD:
+            window_scores[row] = calculate_window_zscore_matrix(data[np.newaxis, :], np.array([variance]), window_size)[0]
+            continue
+
+        number_of_windows = number_of_sites - window_size + 1
+        chunk_size = 4 * window_size
+        window_score = np.empty(number_of_windows)
+        for chunk_start in range(0, number_of_windows, chunk_size):
+            number_of_starts = min(chunk_size, number_of_windows - chunk_start)
+            # Prefix sums with a leading zero over the chunk: sum of sites [i, j) is prefix[j] - prefix[i]
+            chunk_values = values[chunk_start:chunk_start + number_of_starts + window_size - 1]
+            positions = np.arange(len(chunk_values), dtype=np.float64)
+            prefix_values = np.concatenate(([0.0], np.cumsum(chunk_values)))
+            prefix_weighted = np.concatenate(([0.0], np.cumsum(chunk_values * positions)))
+
+            starts = np.arange(number_of_starts)
+            window_sum = prefix_values[starts + window_size] - prefix_values[starts]
+            window_position_sum = prefix_weighted[starts + window_size] - prefix_weighted[starts]
+            weighted_sum = window_sum - 0.5 / (window_size - 1) * (window_position_sum - starts * window_sum)
+            # The weights decrease linearly from 1 to 0.5, their mean is 0.75
+            window_score[chunk_start:chunk_start + number_of_starts] = weighted_sum / (0.75 * window_size)
+
+        window_score = window_score / np.sqrt(variance/window_size)
+        starts = np.arange(number_of_windows)
+        window_score[prefix_missing[starts + window_size] - prefix_missing[starts] > 0] = np.nan
+
+        # Align each window to its middle, as the shift in calculate_window_zscores
+        first_position = window_size - 1 - window_size // 2
+        window_scores[row, first_position:first_position + number_of_windows] = window_score
+
+    return window_scores
+
+
+def sliding_window_sweep_analysis(satute_input_dir, window_sizes, edge_list=None, results_dir=None, data_name=None):
+    """
+    Sliding window analysis for several window sizes, reading the component data only once.
+
+    The results of all branches are saved in <data_name>_sliding_window_sweep.npz in results_dir with the arrays
+    "window_sizes", "datasets" and "branches" (one entry per branch), "number_of_sites" and "zscores"
+    (branch x window size x site, padded with NaN to the longest branch).
+
+    Args:
+        satute_input_dir (str): Directory with the SatuTe output, optionally one subfolder per dataset.
+        window_sizes (iterable of int): The window sizes, e.g. range(10, 60).
+        edge_list (list, optional): List of branches to include. If None, include all branches.
+        results_dir (str, optional): Output directory. If None, satute_input_dir is used.
+        data_name (str, optional): Name of the output files. If None, the name of satute_input_dir is used.
+
+    Returns:
+        dict: Dataset name to a dictionary of branch label to its window size x site z-score array.
+    """
+    if results_dir is None:
+        results_dir = satute_input_dir
+    if data_name is None: 
+        data_name = os.path.basename(satute_input_dir)
+    window_sizes = [int(window_size) for window_size in window_sizes]
+
+    summarized_component_data_dict = summarize_component_data(satute_input_dir, results_dir, data_name, edge_list=edge_list)
+
+    results_per_dataset = {}
+    for dataset, branch, branch_data in iter_branch_data(summarized_component_data_dict, edge_list):
+        variance = calculate_variance(branch_data)
+        window_scores = calculate_window_zscore_sweep(branch_data['coherence'].to_numpy(), variance, window_sizes)
+        results_per_dataset.setdefault(dataset, {})[branch] = window_scores
+
+    datasets, branches, branch_scores = [], [], []
+    for dataset, branch_results_dict in results_per_dataset.items():
+        for branch in sorted(branch_results_dict):
+            datasets.append(dataset)
+            branches.append(branch)
+            branch_scores.append(branch_results_dict[branch])
+
+    if branch_scores:
+        number_of_sites = np.array([scores.shape[1] for scores in branch_scores])
+        zscores = np.full((len(branch_scores), len(window_sizes), number_of_sites.max()), np.nan)
+        for index, scores in enumerate(branch_scores):
+            zscores[index, :, :scores.shape[1]] = scores
+
+        np.savez(
+            os.path.join(results_dir, f"{data_name}_sliding_window_sweep.npz"),
+            window_sizes=np.array(window_sizes),
+            datasets=np.array(datasets, dtype=str),
+            branches=np.array(branches, dtype=str),
+            number_of_sites=number_of_sites,
+            zscores=zscores,
+        )
+
+    return results_per_dataset
+
+
 if __name__ == "__main__":
 
     # Get the current working directory
@@ -121,7 +780,7 @@ if __name__ == "__main__":
     output_dir = os.path.join(current_directory,"../../example/results_sliding_window_analysis/", data_name)
     os.makedirs(output_dir, exist_ok=True)
 
-    sliding_window_analysis(input_dir, window_size=36, edge_list=["(A1, Node1*)","(Node4*, Node2*)"], results_dir=output_dir)
+    sliding_window_analysis(input_dir, window_size=36, edge_list=["(A1, Node1*)","(Node4*, Node2*)"], results_dir=output_dir, pyramid=True)
 
 
 
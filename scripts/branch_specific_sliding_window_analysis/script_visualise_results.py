@@ -13,6 +13,10 @@ from utils.script_analyses_utils import (
     find_file_with_suffix_in_directory,
 )
 
+from branch_specific_sliding_window_analysis.script_window_pyramid import (
+    read_window_pyramid,
+)
+
 def plot_coherence_distribution_per_branch(results_dir, start_site=None, end_site=None, edge_list=None, bins = 10):
     """
     Plots the coherence coefficients of all considered site (coherence distribution) for each branch.
@@ -148,6 +152,45 @@ def plot_sliding_window_analysis_combined(csv_files, results_dir, edge_list=None
     print(f"Combined plot for Sliding Window Analysis has been saved to {output_pdf}")
 
 
+def plot_sliding_window_pyramid(store_dir, results_dir, edge_list=None, start_site=None, end_site=None, width_pixels=2000):
+    """
+    Plots the sliding window analysis from a multi-resolution store, reading only the resolution needed for the plot.
+
+    For every branch, the mean z-score of each bin is drawn as a line and the range from the minimal to the maximal
+    z-score as a band, so that drops below a threshold stay visible at any zoom level.
+
+    Args:
+        store_dir (str): Directory of the store, written by sliding_window_analysis with pyramid=True.
+        results_dir (str): Directory where the output PDF will be saved.
+        edge_list (list, optional): List of branches to include in the plot. If None, include all branches of the store.
+        start_site (int, optional): Start of the site range. If None, starts from the first site.
+        end_site (int, optional): End of the site range. If None, ends at the last site.
+        width_pixels (int, optional): Maximal number of points per branch. Default is 2000.
+    """
+    level, tracks = read_window_pyramid(store_dir, edge_list, start_site, end_site, max_points=width_pixels)
+
+    store_name = os.path.basename(os.path.normpath(store_dir)).replace(".pyramid", "")
+    output_pdf = os.path.join(results_dir, f"Sliding_window_analysis_{store_name}_for_{len(tracks)}_branches.pdf")
+
+    plt.figure(figsize=(10, 6))
+    for branch, track in tracks.items():
+        track = track[track['site'] >= 0]
+        line, = plt.plot(track['site'], track['mean_zscore'], label=branch[:30])
+        if level > 0:
+            plt.fill_between(track['site'], track['min_zscore'], track['max_zscore'], color=line.get_color(), alpha=0.3)
+
+    plt.xlabel('Site', fontsize=12)
+    plt.ylabel('Z-score', fontsize=12)
+    plt.title(f'Sliding Window Analysis for {len(tracks)} Branches (bins of {2 ** level} sites)', fontsize=14)
+    plt.legend(title='Branch', loc='best')
+    plt.grid(True)
+
+    plt.savefig(output_pdf)
+    plt.close()
+
+    print(f"Plot of the multi-resolution store has been saved to {output_pdf}")
+
+
 
 
 
@@ -173,3 +216,6 @@ if __name__ == "__main__":
 
    
 
+    store_dir = os.path.join(results_dir, "SatuTe_without_rate_heterogeneity_sliding_window_size_36.pyramid")
+    if os.path.isdir(store_dir):
+        plot_sliding_window_pyramid(store_dir, results_dir, width_pixels=200)
@@ -0,0 +1,159 @@
+import pandas as pd
+import numpy as np
+import json
+import os
+
+
+""" Multi-resolution store of sliding window tracks
+
+A store is a directory holding, for every decimation level k, the arrays
+level_<k>_sites.npy, level_<k>_min.npy, level_<k>_max.npy and level_<k>_mean.npy
+(branch x bin). A bin of level k covers 2^k consecutive sites of a track, level 0 holds
+the window z-scores themselves. Sites are the alignment sites of the first value of a bin,
+-1 where a track is shorter than the longest one. Every array is read memory-mapped, so a
+reader only touches the level and the columns it needs.
+"""
+
+PYRAMID_METADATA_FILE = "metadata.json"
+
+
+def get_window_pyramid_path(results_dir, dataset, window_size, kernel=None):
+    kernel_suffix = "" if kernel is None else f"_{kernel}"
+    return os.path.join(results_dir, f"{dataset}_sliding_window_size_{window_size}{kernel_suffix}.pyramid")
+
+
+def get_pyramid_level_path(store_dir, level, array_name):
+    return os.path.join(store_dir, f"level_{level}_{array_name}.npy")
+
+
+def decimate_level(sites, minimum, maximum, total, count):
+    # Merges pairs of bins of the previous level, an odd last bin is paired with an empty bin
+    if minimum.shape[1] % 2:
+        empty_bin = lambda array, value: np.full((array.shape[0], 1), value, dtype=array.dtype)
+        sites = np.hstack((sites, empty_bin(sites, -1)))
+        minimum = np.hstack((minimum, empty_bin(minimum, np.nan)))
+        maximum = np.hstack((maximum, empty_bin(maximum, np.nan)))
+        total = np.hstack((total, empty_bin(total, 0.0)))
+        count = np.hstack((count, empty_bin(count, 0)))
+
+    # fmin and fmax ignore NaN unless both bins are NaN
+    minimum = np.fmin(minimum[:, 0::2], minimum[:, 1::2])
+    maximum = np.fmax(maximum[:, 0::2], maximum[:, 1::2])
+    total = total[:, 0::2] + total[:, 1::2]
+    count = count[:, 0::2] + count[:, 1::2]
+    return sites[:, 0::2], minimum, maximum, total, count
+
+
+def write_window_pyramid(store_dir, sliding_window_df, branch_sites, window_size, dataset=None, kernel=None):
+    """
+    Writes the window z-score tracks of a dataset to a multi-resolution store.
+
+    Args:
+        store_dir (str): Directory of the store, see get_window_pyramid_path.
+        sliding_window_df (DataFrame): Window z-scores, one column per branch, as written by sliding_window_analysis.
+        branch_sites (dict): Branch label to the site of every value of its track.
+        window_size (int): Window size of the tracks.
+        dataset (str, optional): Name of the dataset, stored in the metadata.
+        kernel (str, optional): Window kernel of the tracks, stored in the metadata.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    branches = list(sliding_window_df.columns)
+    zscores = sliding_window_df.to_numpy(dtype=np.float64).T
+
+    sites = np.full(zscores.shape, -1, dtype=np.int64)
+    number_of_sites = []
+    for row, branch in enumerate(branches):
+        branch_site_array = np.asarray(branch_sites[branch], dtype=np.int64)[:zscores.shape[1]]
+        sites[row, :len(branch_site_array)] = branch_site_array
+        number_of_sites.append(len(branch_site_array))
+
+    valid = ~np.isnan(zscores)
+    minimum, maximum = zscores, zscores
+    total, count = np.where(valid, zscores, 0.0), valid.astype(np.int64)
+
+    level = 0
+    while True:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+        for array_name, array in [("sites", sites), ("min", minimum), ("max", maximum), ("mean", mean)]:
+            np.save(get_pyramid_level_path(store_dir, level, array_name), array)
+        if sites.shape[1] <= 1:
+            break
+        sites, minimum, maximum, total, count = decimate_level(sites, minimum, maximum, total, count)
+        level += 1
+
+    metadata = {
+        "dataset": dataset,
+        "window_size": window_size,
+        "kernel": kernel,
+        "branches": branches,
+        "number_of_sites": number_of_sites,
+        "number_of_levels": level + 1,
+    }
+    with open(os.path.join(store_dir, PYRAMID_METADATA_FILE), "w") as metadata_file:
+        json.dump(metadata, metadata_file, indent=1)
+
+
+def read_window_pyramid_metadata(store_dir):
+    with open(os.path.join(store_dir, PYRAMID_METADATA_FILE), "r") as metadata_file:
+        return json.load(metadata_file)
+
+
+def select_pyramid_level(number_of_values, max_points, number_of_levels):
+    # The finest level with at most max_points bins in the requested range
+    level = 0
+    while level + 1 < number_of_levels and -(-number_of_values // 2 ** level) > max_points:
+        level += 1
+    return level
+
+
+def read_window_pyramid(store_dir, branches=None, start_site=None, end_site=None, max_points=2000):
+    """
+    Reads the window tracks of a store at the resolution needed to show them with max_points points.
+
+    Args:
+        store_dir (str): Directory of the store.
+        branches (list, optional): Branches to read. If None, all branches.
+        start_site (int, optional): First site of the range. If None, starts from the first site.
+        end_site (int, optional): Last site of the range. If None, ends at the last site.
+        max_points (int, optional): Maximal number of points per branch, e.g. the width of the plot in pixels. Default is 2000.
+
+    Returns:
+        tuple: The level read and a dictionary of branch label to a DataFrame with the columns
+        site, min_zscore, max_zscore and mean_zscore.
+    """
+    metadata = read_window_pyramid_metadata(store_dir)
+    all_branches = metadata["branches"]
+    if branches is None:
+        branches = all_branches
+    rows = [all_branches.index(branch) for branch in branches]
+
+    # Number of values of the longest requested track within the range, from level 0
+    level_0_sites = np.load(get_pyramid_level_path(store_dir, 0, "sites"), mmap_mode="r")
+    number_of_values = 0
+    ranges = {}
+    for row in rows:
+        branch_sites = level_0_sites[row, :metadata["number_of_sites"][row]]
+        first = 0 if start_site is None else np.searchsorted(branch_sites, start_site, side="left")
+        last = len(branch_sites) if end_site is None else np.searchsorted(branch_sites, end_site, side="right")
+        ranges[row] = (first, last)
+        number_of_values = max(number_of_values, last - first)
+
+    level = select_pyramid_level(number_of_values, max_points, metadata["number_of_levels"])
+    level_arrays = {
+        array_name: np.load(get_pyramid_level_path(store_dir, level, array_name), mmap_mode="r")
+        for array_name in ["sites", "min", "max", "mean"]
+    }
+
+    tracks = {}
+    for branch, row in zip(branches, rows):
+        first, last = ranges[row]
+        # Bins overlapping the range
+        columns = slice(first >> level, -(-last // 2 ** level))
+        tracks[branch] = pd.DataFrame({
+            "site": np.asarray(level_arrays["sites"][row, columns]),
+            "min_zscore": np.asarray(level_arrays["min"][row, columns]),
+            "max_zscore": np.asarray(level_arrays["max"][row, columns]),
+            "mean_zscore": np.asarray(level_arrays["mean"][row, columns]),
+        })
+    return level, tracks
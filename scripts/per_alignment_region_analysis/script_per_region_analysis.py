@@ -3,6 +3,7 @@ import sys
 import os
 
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
 import seaborn as sns
 from matplotlib.backends.backend_pdf import PdfPages
@@ -12,11 +13,27 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from utils.script_handle_satute_components import (
     calculate_variance, 
+    get_dataset_directories,
+    iter_branch_data,
+    stream_component_data,
     summarize_component_data,
+    write_summarized_component_data,
+)
+
+from utils.script_satute_run import (
+    get_satute_run,
 )
 
 from utils.script_analyses_utils import (
-    get_regions_from_annotation
+    get_regions_from_annotation,
+    get_sites_from_intervals,
+    load_region_annotation,
+    load_region_intervals,
+)
+
+from utils.script_coherence_matrix import (
+    get_coherence_matrix,
+    select_branches,
 )
 
 
@@ -79,66 +96,346 @@ def calculate_region_zscores_per_branch( component_dataframe, region_info):
         
     return region_score, variance
 
-def per_region_analysis(annotation_file, satute_input_dir, edge_list=None, results_dir=None, data_name =None):
+def calculate_zscores_from_region_sums(sums, counts, nan_counts, variances):
+    # NaN for regions without sites and, as np.mean in calculate_zscore_per_region, for regions with a NaN value
+    with np.errstate(invalid="ignore", divide="ignore"):
+        averages = sums / counts
+        standard_errors = np.sqrt(np.asarray(variances, dtype=np.float64)[:, np.newaxis] / counts)
+        return np.where((counts > 0) & (nan_counts == 0), averages / standard_errors, np.nan)
+
+
+def calculate_region_zscore_matrix(coherence, variances, region_info, first_site=0, chunk_size=65536, return_counts=False, present=None):
+    """
+    Computes the z-scores of all regions for all branches at once from a branch x site matrix.
+
+    The sites of all regions are gathered as one block of columns, and the sums and site counts
+    of the regions are segment sums over this block (np.add.reduceat), the product of the matrix with
+    the region indicator matrix. Regions may overlap.
+
+    As in calculate_zscore_per_region, sites outside the matrix or not present for a branch are ignored,
+    and a present site with a NaN coherence value makes the z-score of its regions NaN.
+
+    Args:
+        coherence (np.ndarray): Coherence coefficients, one row per branch and one column per site.
+        variances (np.ndarray): Variance of each branch.
+        region_info (dict): Region name to the sites of the region.
+        first_site (int, optional): Site of the first column of coherence. Default is 0.
+        chunk_size (int, optional): Number of gathered values per branch chunk. Default is 65536.
+        return_counts (bool, optional): Also return the number of sites per branch and region. Default is False.
+        present (np.ndarray, optional): True where a branch has data for a site, see CoherenceMatrix.
+            If None, the sites with a coherence value other than NaN.
+
+    Returns:
+        np.ndarray: The z-scores (branch x region, in the order of region_info), NaN for regions without
+        present sites or with a NaN coherence value. If return_counts, a tuple of the z-scores and the
+        number of present sites of every region.
+    """
+    number_of_branches, number_of_sites = coherence.shape
+
+    # Columns of the region sites, one segment per region
+    region_columns = []
+    for sites in region_info.values():
+        columns = np.asarray(sites, dtype=np.int64) - first_site
+        region_columns.append(columns[(columns >= 0) & (columns < number_of_sites)])
+    region_sizes = np.array([len(columns) for columns in region_columns], dtype=np.int64)
+    non_empty = np.flatnonzero(region_sizes > 0)
+
+    if present is None:
+        present = ~np.isnan(coherence)
+
+    sums = np.zeros((number_of_branches, len(region_columns)))
+    counts = np.zeros((number_of_branches, len(region_columns)), dtype=np.int64)
+    nan_counts = np.zeros((number_of_branches, len(region_columns)), dtype=np.int64)
+    if len(non_empty) > 0 and number_of_branches > 0:
+        all_columns = np.concatenate([region_columns[region] for region in non_empty])
+        offsets = np.concatenate(([0], np.cumsum(region_sizes[non_empty])[:-1]))
+
+        branches_per_chunk = max(1, chunk_size // len(all_columns))
+        for start in range(0, number_of_branches, branches_per_chunk):
+            chunk = slice(start, start + branches_per_chunk)
+            gathered = coherence[chunk][:, all_columns]
+            gathered_present = present[chunk][:, all_columns]
+            nan_values = gathered_present & np.isnan(gathered)
+            sums[chunk, non_empty] = np.add.reduceat(np.where(gathered_present & ~nan_values, gathered, 0.0), offsets, axis=1)
+            counts[chunk, non_empty] = np.add.reduceat(gathered_present, offsets, axis=1)
+            nan_counts[chunk, non_empty] = np.add.reduceat(nan_values, offsets, axis=1)
+
+    region_zscores = calculate_zscores_from_region_sums(sums, counts, nan_counts, variances)
+
+    if return_counts:
+        return region_zscores, counts
+    return region_zscores
+
+
+def calculate_region_zscore_matrix_from_intervals(coherence, variances, region_intervals, first_site=0, site_offset=0, return_counts=False, present=None):
+    """
+    Computes the z-scores of all regions for all branches from the intervals of a partition file.
+
+    The sum and the number of present sites of every interval are differences of per-branch prefix sums,
+    so the cost grows with the number of intervals and not with the number of annotated sites. Missing
+    sites and NaN coherence values are handled as in calculate_region_zscore_matrix.
+
+    Args:
+        coherence (np.ndarray): Coherence coefficients, one row per branch and one column per site.
+        variances (np.ndarray): Variance of each branch.
+        region_intervals (RegionIntervals): The intervals, see utils.script_analyses_utils.load_region_intervals.
+        first_site (int, optional): Site of the first column of coherence. Default is 0.
+        site_offset (int, optional): Added to the interval coordinates to get sites, e.g. -1 if the
+            partition is 1-based and the sites are 0-based. Default is 0.
+        return_counts (bool, optional): Also return the number of sites per branch and region. Default is False.
+        present (np.ndarray, optional): True where a branch has data for a site, see CoherenceMatrix.
+            If None, the sites with a coherence value other than NaN.
+
+    Returns:
+        np.ndarray: The z-scores (branch x region, in the order of region_intervals.regions), NaN for regions
+        without present sites or with a NaN coherence value. If return_counts, a tuple of the z-scores and
+        the number of present sites of every region.
+    """
+    number_of_branches, number_of_sites = coherence.shape
+    number_of_regions = len(region_intervals.regions)
+
+    # Columns of the intervals, clipped to the matrix
+    starts = np.maximum(region_intervals.starts + site_offset - first_site, 0)
+    ends = np.minimum(region_intervals.ends + site_offset - first_site, number_of_sites - 1)
+    inside = starts <= ends
+    starts, ends, region_codes = starts[inside], ends[inside], region_intervals.region_codes[inside]
+
+    if present is None:
+        present = ~np.isnan(coherence)
+
+    sums = np.zeros((number_of_branches, number_of_regions))
+    counts = np.zeros((number_of_branches, number_of_regions), dtype=np.int64)
+    nan_counts = np.zeros((number_of_branches, number_of_regions), dtype=np.int64)
+    if len(starts) > 0 and number_of_branches > 0:
+        # NaN values are counted apart, in the value prefix sums they would spoil all later intervals
+        nan_values = present & np.isnan(coherence)
+        zeros = np.zeros((number_of_branches, 1))
+        value_prefix = np.concatenate((zeros, np.cumsum(np.where(present & ~nan_values, coherence, 0.0), axis=1)), axis=1)
+        count_prefix = np.concatenate((zeros.astype(np.int64), np.cumsum(present, axis=1)), axis=1)
+        nan_prefix = np.concatenate((zeros.astype(np.int64), np.cumsum(nan_values, axis=1)), axis=1)
+
+        # The intervals are sorted by region, one segment per region
+        codes, offsets = np.unique(region_codes, return_index=True)
+        sums[:, codes] = np.add.reduceat(value_prefix[:, ends + 1] - value_prefix[:, starts], offsets, axis=1)
+        counts[:, codes] = np.add.reduceat(count_prefix[:, ends + 1] - count_prefix[:, starts], offsets, axis=1)
+        nan_counts[:, codes] = np.add.reduceat(nan_prefix[:, ends + 1] - nan_prefix[:, starts], offsets, axis=1)
+
+    region_zscores = calculate_zscores_from_region_sums(sums, counts, nan_counts, variances)
+
+    if return_counts:
+        return region_zscores, counts
+    return region_zscores
+
+
+def calculate_region_zscores_all_branches(matrix, region_info, edge_list=None, region_intervals=None, site_offset=0):
+    """
+    Computes the region z-scores of all branches of one dataset in one batch.
+
+    The results equal those of calculate_region_zscores_per_branch for every branch up to rounding,
+    as the sums are accumulated in a different order.
+
+    Args:
+        matrix (CoherenceMatrix): The coherence matrix of the dataset, see utils.script_coherence_matrix.get_coherence_matrix.
+        region_info (dict): Region name to the sites of the region. Not used if region_intervals is given.
+        edge_list (list, optional): List of branches to include. If None, include all branches.
+        region_intervals (RegionIntervals, optional): Intervals of the regions. If given, the region sums
+            are computed from prefix sums, see calculate_region_zscore_matrix_from_intervals.
+        site_offset (int, optional): Added to the interval coordinates to get sites. Default is 0.
+
+    Returns:
+        tuple: The region z-scores (DataFrame with a region column and one column per branch in sorted
+        order, None if there are no branches or regions) and the branch variances (dict).
+    """
+    branches, coherence, present, variances = select_branches(matrix, edge_list)
+    variance_per_branch = dict(zip(branches, variances.tolist()))
+    regions = list(region_intervals.regions if region_intervals is not None else region_info)
+    if not branches or not regions:
+        return None, variance_per_branch
+
+    if region_intervals is not None:
+        region_zscores = calculate_region_zscore_matrix_from_intervals(
+            coherence, variances, region_intervals, first_site=matrix.first_site,
+            site_offset=site_offset, present=present,
+        )
+    else:
+        region_zscores = calculate_region_zscore_matrix(
+            coherence, variances, region_info, first_site=matrix.first_site, present=present
+        )
+
+    combined_region_df = pd.DataFrame({'region': regions})
+    for branch in sorted(branches):
+        combined_region_df[branch] = region_zscores[branches.index(branch)]
+    return combined_region_df, variance_per_branch
+
+
+def combine_region_results(branch_results_dict):
+    # Combine all branch DataFrames into a single DataFrame, branches in sorted order
+    branch_results_dict = {branch: branch_results_dict[branch] for branch in sorted(branch_results_dict)}
+    combined_region_df = pd.concat(branch_results_dict.values(), axis=1)
+
+    # Ensure the 'region' column is not duplicated during concatenation
+    return combined_region_df.loc[:,~combined_region_df.columns.duplicated()]
+
+
+def write_region_results(region_dict, results_dir):
+    """
+    Saves the region z-scores of every dataset as <dataset>_per_region_zscores.csv and plots them.
+
+    Args:
+        region_dict (dict): Dataset name to its combined region z-scores.
+        results_dir (str): Output directory.
+
+    Returns:
+        DataFrame or None: The region z-scores of the last dataset, None if no dataset has results.
+    """
+    combined_region_df = None
+    for dataset, combined_region_df in region_dict.items():
+        # Define the path to save the results
+        region_csv_path = os.path.join(results_dir, f"{dataset}_per_region_zscores.csv")
+
+        # Save the combined DataFrame to a CSV file
+        combined_region_df.to_csv(region_csv_path, index=False)
+
+        plot_zscores_per_region(combined_region_df, dataset, results_dir)
+
+    if not region_dict:
+        print("Folder might be wrong.")
+
+    return combined_region_df
+
+
+def per_region_analysis_of_dataset(dataset, directory, region_info, edge_list=None, batched=False, region_intervals=None, results_dir=None, site_offset=0):
+    """
+    Computes the region z-scores of all branches of one dataset end to end: ingest, variances and z-scores.
+
+    Defined at module level so that it can run in a worker process, see the workers option of per_region_analysis.
+
+    Args:
+        dataset (str): Name of the dataset.
+        directory (str): Directory with the SatuTe output of the dataset.
+        region_info (dict): Region name to the sites of the region.
+        edge_list (list, optional): List of branches to include. If None, include all branches.
+        batched (bool, optional): Compute all branches at once, see calculate_region_zscores_all_branches. Default is False.
+        region_intervals (RegionIntervals, optional): Intervals of the regions for the batched computation. Default is None.
+        results_dir (str, optional): Directory of the coherence matrix of the batched computation. If None, directory is used.
+        site_offset (int, optional): Added to the interval coordinates to get sites. Default is 0.
+
+    Returns:
+        tuple: The dataset name, its component data sorted by branch and site, the combined region
+        z-scores (None if there are none) and the global variance records.
+    """
+    # Not kept by the run, a worker process handles many datasets
+    component_data = get_satute_run(directory).get_component_data(dataset, edge_list=edge_list, memoize=False)
+    if component_data.empty:
+        return dataset, component_data, None, []
+
+    if batched:
+        matrix = get_coherence_matrix(
+            directory, directory if results_dir is None else results_dir, dataset,
+            component_data=component_data if edge_list is None else None,
+        )
+        combined_region_df, variance_per_branch = calculate_region_zscores_all_branches(
+            matrix, region_info, edge_list, region_intervals, site_offset
+        )
+        global_variance_list = [
+            {'dataset': dataset, 'branch': branch, 'variance': variance}
+            for branch, variance in variance_per_branch.items()
+        ] if combined_region_df is not None else []
+        return dataset, component_data, combined_region_df, global_variance_list
+
+    branch_results_dict = {}
+    global_variance_list = []
+    # One pass over the groups instead of masking the data for every branch
+    for branch, branch_data in component_data.groupby('branch', sort=False, observed=True):
+        if edge_list is not None and branch not in edge_list:
+            continue
+        region_zscores, variance = calculate_region_zscores_per_branch(branch_data, region_info)
+        if region_zscores:
+            region_df = pd.DataFrame.from_dict(region_zscores, orient='index', columns=[branch])
+            branch_results_dict[branch] = region_df.reset_index().rename(columns={'index': 'region'})
+            global_variance_list.append({'dataset': dataset, 'branch': branch, 'variance': variance})
+
+    combined_region_df = combine_region_results(branch_results_dict) if branch_results_dict else None
+    return dataset, component_data, combined_region_df, global_variance_list
+
+
+def per_region_analysis(annotation_file, satute_input_dir, edge_list=None, results_dir=None, data_name =None, streaming=False, workers=None, batched=False, number_of_sites=None, site_offset=0):
     # If results_dir is None, use satute_input_dir
     if results_dir is None:
         results_dir = satute_input_dir
     if data_name is None: 
         data_name = os.path.basename(satute_input_dir)
 
-    # Get regions information for annotation file
-    region_info = get_regions_from_annotation(annotation_file)
+    # Regions of NEXUS or IQ-TREE partition files are evaluated from their intervals
+    # (number_of_sites is only needed for partition ranges ending at the end of the alignment, ".",
+    # site_offset is added to the partition coordinates to get sites)
+    region_intervals = load_region_intervals(annotation_file, number_of_sites)
+    if region_intervals is None:
+        # Get regions information for annotation file
+        region_info = load_region_annotation(annotation_file).region_sites
+    elif streaming:
+        # The streamed branches are evaluated site by site
+        region_info = {region: sites + site_offset for region, sites in get_sites_from_intervals(region_intervals).items()}
+    else:
+        # The intervals are never expanded into sites
+        region_info = None
+        batched = True
+
+    if workers is not None and not streaming:
+        return per_region_analysis_parallel(region_info, satute_input_dir, edge_list, results_dir, data_name, workers, batched, region_intervals, site_offset)
 
     ### Summarize all data of the coeherence coefficients per site in the directory
-    summarized_component_data_dict = summarize_component_data(satute_input_dir, results_dir, data_name)
-    region_dict = {}
-    global_variance_list = []
+    if streaming:
+        # Read one branch at a time instead of holding all component data in memory
+        branch_data_iterator = stream_component_data(satute_input_dir, results_dir, data_name, edge_list)
+    else:
+        summarized_component_data_dict = summarize_component_data(satute_input_dir, results_dir, data_name, edge_list=edge_list)
+        branch_data_iterator = iter_branch_data(summarized_component_data_dict, edge_list)
 
-    for dataset in summarized_component_data_dict.keys():
-        unique_branches = summarized_component_data_dict[dataset]['branch'].unique()
-        branch_results_dict = {}  # Dictionary to hold rolling results for each branch
-
-        for branch in unique_branches:
-            if edge_list is None or branch in edge_list:
-                # Filter the dataset for the current branch
-                branch_data = summarized_component_data_dict[dataset][summarized_component_data_dict[dataset]['branch'] == branch]
-
-                # Calculate custom rolling metric using the window size
-                region_zscores, variance = calculate_region_zscores_per_branch(branch_data, region_info)
-          
-                if region_zscores:  # Only proceed if region_zscores is not empty
-                    # Convert the region_zscores dictionary to a DataFrame
-                    region_df = pd.DataFrame.from_dict(region_zscores, orient='index', columns=[branch])
-
-                    # Reset the index to convert the region names from the index to a column
-                    region_df = region_df.reset_index()
-
-                    # Rename the index column to 'region'
-                    region_df = region_df.rename(columns={'index': 'region'})
-                    
-                    # Store the DataFrame in branch_results_dict under the branch name
-                    branch_results_dict[branch] = region_df 
-                    global_variance_list.append({'dataset': dataset, 'branch': branch, 'variance': variance})
- 
-    if branch_results_dict:
-        # Combine all branch DataFrames into a single DataFrame
-        combined_region_df = pd.concat(branch_results_dict.values(), axis=1)
-
-        # Ensure the 'region' column is not duplicated during concatenation
-        combined_region_df = combined_region_df.loc[:,~combined_region_df.columns.duplicated()]
-        
-        # Store the combined DataFrame in region_dict under the dataset key
-        region_dict[dataset] = combined_region_df
-
-        # Define the path to save the results
-        region_csv_path = os.path.join(results_dir, f"{dataset}_per_region_zscores.csv")
-
-        # Save the combined DataFrame to a CSV file
-        combined_region_df.to_csv(region_csv_path, index=False)
+    global_variance_list = []
+    results_per_dataset = {}  # Dictionary to hold region results for each branch per dataset
+    batched_results = {}  # Combined region results per dataset of the batched computation
+
+    if batched and not streaming:
+        # All regions of all branches of a dataset at once, from the memory-mapped coherence matrix of its directory
+        branch_data_iterator = []
+        directories = dict(get_dataset_directories(satute_input_dir))
+        for dataset, component_data in summarized_component_data_dict.items():
+            matrix = get_coherence_matrix(
+                directories[dataset], results_dir, dataset, component_data=component_data if edge_list is None else None
+            )
+            combined_region_df, variance_per_branch = calculate_region_zscores_all_branches(
+                matrix, region_info, edge_list, region_intervals, site_offset
+            )
+            if combined_region_df is not None:
+                batched_results[dataset] = combined_region_df
+                global_variance_list.extend(
+                    {'dataset': dataset, 'branch': branch, 'variance': variance}
+                    for branch, variance in variance_per_branch.items())
+
+    for dataset, branch, branch_data in branch_data_iterator:
+        # Calculate custom rolling metric using the window size
+        region_zscores, variance = calculate_region_zscores_per_branch(branch_data, region_info)
+  
+        if region_zscores:  # Only proceed if region_zscores is not empty
+            # Convert the region_zscores dictionary to a DataFrame
+            region_df = pd.DataFrame.from_dict(region_zscores, orient='index', columns=[branch])
+
+            # Reset the index to convert the region names from the index to a column
+            region_df = region_df.reset_index()
+
+            # Rename the index column to 'region'
+            region_df = region_df.rename(columns={'index': 'region'})
+            
+            # Store the DataFrame in branch_results_dict under the branch name
+            results_per_dataset.setdefault(dataset, {})[branch] = region_df 
+            global_variance_list.append({'dataset': dataset, 'branch': branch, 'variance': variance})
 
-        plot_zscores_per_region(combined_region_df, dataset, results_dir) 
-    else: 
-        print("Folder might be wrong.")
+    # Combined results of every dataset with matching branches
+    region_dict = dict(batched_results)
+    for dataset, branch_results_dict in results_per_dataset.items():
+        region_dict[dataset] = combine_region_results(branch_results_dict)
+    combined_region_df = write_region_results(region_dict, results_dir)
 
     if global_variance_list:  # Check if global_variance_list is not empty
         # Convert the list of dictionaries into a DataFrame
@@ -151,6 +448,118 @@ def per_region_analysis(annotation_file, satute_input_dir, edge_list=None, resul
     return combined_region_df
 
 
+def per_region_analysis_parallel(region_info, satute_input_dir, edge_list, results_dir, data_name, workers, batched=False, region_intervals=None, site_offset=0):
+    """
+    per_region_analysis with every dataset processed end to end in a worker process.
+
+    The outputs are the same as those of per_region_analysis: the summarized component data and
+    global variances of all datasets, the region z-scores and plots of every dataset.
+    """
+    summarized_component_data_dict = {}
+    global_variance_list = []
+    region_dict = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                per_region_analysis_of_dataset, dataset, directory, region_info, edge_list, batched, region_intervals,
+                results_dir, site_offset,
+            )
+            for dataset, directory in get_dataset_directories(satute_input_dir)
+        ]
+        for future in futures:
+            dataset, component_data, combined_region_df, dataset_variance_list = future.result()
+            if component_data.empty:
+                continue
+            summarized_component_data_dict[dataset] = component_data
+            global_variance_list.extend(dataset_variance_list)
+            if combined_region_df is not None:
+                region_dict[dataset] = combined_region_df
+
+    if summarized_component_data_dict:
+        write_summarized_component_data(summarized_component_data_dict, results_dir, data_name)
+
+    combined_region_df = write_region_results(region_dict, results_dir)
+
+    if global_variance_list:
+        global_variance_df = pd.DataFrame(global_variance_list)
+        csv_file_path = os.path.join(results_dir, f"{data_name}_global_variance.csv")
+        global_variance_df.to_csv(csv_file_path, index=False)
+
+    return combined_region_df
+
+
+def multi_level_region_analysis(annotation_files, satute_input_dir, edge_list=None, results_dir=None, data_name=None, number_of_sites=None):
+    """
+    Computes the region z-scores of several annotation levels, e.g. genes and the regions within them, in one pass.
+
+    The component data is summarized once and, for every dataset, the regions of all levels are evaluated
+    together against the same coherence matrix, see calculate_region_zscore_matrix. Regions may be nested
+    or overlap, within and across levels. The results of all datasets are saved as a tidy table
+    <data_name>_multi_level_region_zscores.csv in results_dir, no plots are made.
+
+    Args:
+        annotation_files (dict): Level name to its region annotation file (site, region_name).
+        satute_input_dir (str): Directory with the SatuTe output, optionally one subfolder per dataset.
+        edge_list (list, optional): List of branches to include. If None, include all branches.
+        results_dir (str, optional): Output directory. If None, satute_input_dir is used.
+        data_name (str, optional): Name of the output files. If None, the name of satute_input_dir is used.
+        number_of_sites (int, optional): Number of sites of the alignment, for partition ranges ending in ".".
+
+    Returns:
+        DataFrame: The columns dataset, level, region, branch, zscore and n_sites, the number of sites
+        of the region with data for the branch. A region with a NaN coherence value has a NaN zscore.
+    """
+    if results_dir is None:
+        results_dir = satute_input_dir
+    if data_name is None:
+        data_name = os.path.basename(satute_input_dir)
+
+    # Regions of all levels, keyed by (level, region)
+    level_region_info = {}
+    for level, annotation_file in annotation_files.items():
+        for region, sites in get_regions_from_annotation(annotation_file, number_of_sites).items():
+            level_region_info[(level, region)] = sites
+    levels = [level for level, _ in level_region_info]
+    regions = [region for _, region in level_region_info]
+
+    summarized_component_data_dict = summarize_component_data(satute_input_dir, results_dir, data_name, edge_list=edge_list)
+
+    region_tables = []
+    directories = dict(get_dataset_directories(satute_input_dir))
+    for dataset, component_data in summarized_component_data_dict.items():
+        matrix = get_coherence_matrix(
+            directories[dataset], results_dir, dataset, component_data=component_data if edge_list is None else None
+        )
+        branches, coherence, present, variances = select_branches(matrix, edge_list)
+        if not branches or not level_region_info:
+            continue
+        region_zscores, counts = calculate_region_zscore_matrix(
+            coherence, variances, level_region_info, first_site=matrix.first_site,
+            return_counts=True, present=present,
+        )
+
+        for branch in sorted(branches):
+            row = branches.index(branch)
+            region_tables.append(pd.DataFrame({
+                'dataset': dataset,
+                'level': levels,
+                'region': regions,
+                'branch': branch,
+                'zscore': region_zscores[row],
+                'n_sites': counts[row],
+            }))
+
+    columns = ['dataset', 'level', 'region', 'branch', 'zscore', 'n_sites']
+    region_zscores_df = pd.concat(region_tables, ignore_index=True) if region_tables else pd.DataFrame(columns=columns)
+
+    csv_file_path = os.path.join(results_dir, f"{data_name}_multi_level_region_zscores.csv")
+    region_zscores_df.to_csv(csv_file_path, index=False)
+    print(f"Region z-scores of {len(annotation_files)} annotation levels have been saved to {csv_file_path}")
+
+    return region_zscores_df
+
+
 def plot_zscores_per_region(region_df, dataset_name, results_dir, edge_list=None):
     # Calculate the maximum and minimum z-scores across all branches
     y_max = region_df.drop(columns=['region']).max().max()
@@ -8,28 +8,15 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from matplotlib.backends.backend_pdf import PdfPages
 
-# Add the root directory (scripts) to the Python path
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-
-from utils.script_handle_data import (
-    extract_relative_category_rates_from_satute
-)
-
-
 # Add the root directory (scripts) to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from utils.script_handle_data import (
     process_directory,
-    summarize_z_scores_categories,
-)
-
-from utils.script_analyses_utils import (
-    find_file_with_suffix_in_directory,
 )
 
-from utils.script_handle_tree import (
-    get_newick_string_from_satute,
+from utils.script_satute_run import (
+    get_satute_run,
 )
 
 def summary_analysis_branch_saturation(input_dir, data_name, newick_string,results_dir):
@@ -93,6 +80,10 @@ def plot_summary_z_scores_per_branch(z_score_data, category_rates, dataset_name,
                 print(f"Missing z_alpha data for branch {branch}. Skipping...")
                 continue
 
+            # Seaborn groups by the plotted columns, plain values instead of categories keep it from
+            # grouping over unobserved categories (order keeps the category order)
+            branch_data = branch_data.astype({"rate_category": object, "branch": object})
+
             # Calculate z_alpha and z_alpha_corrected for this branch
             z_alpha =   branch_data["z_alpha"].iloc[0]
             z_alpha_corrected = branch_data["z_alpha_bonferroni_corrected"].iloc[0]
@@ -166,11 +157,11 @@ def plot_summary_z_scores_per_branch(z_score_data, category_rates, dataset_name,
 
 
 def summary_category_zscore_per_branch(satute_input_dir, data_name, results_dir, edge_list=None):
+    satute_run = get_satute_run(satute_input_dir)
 
-    zscore_data = summarize_z_scores_categories(satute_input_dir, data_name)
-
-    satute_file = find_file_with_suffix_in_directory(".satute", satute_input_dir)
-    category_rates = extract_relative_category_rates_from_satute(satute_file)
+    # Copy, the plot changes the rate categories of the shared z-score data
+    zscore_data = satute_run.get_zscore_data(data_name).copy()
+    category_rates = satute_run.category_rates
     
     plot_summary_z_scores_per_branch(zscore_data, category_rates, data_name, results_dir, edge_list)
  
@@ -185,8 +176,7 @@ def per_category_analysis(satute_input_dir, edge_list=None, results_dir=None, da
 
     #get considered tree 
     print("Summary Branch Saturation\n")
-    satute_file = find_file_with_suffix_in_directory(".satute", satute_input_dir)
-    newick_string = get_newick_string_from_satute(satute_file)
+    newick_string = get_satute_run(satute_input_dir).newick_string
     summary_analysis_branch_saturation(satute_input_dir, data_name, newick_string, results_dir)
 
     print("\nSummary Zscores")
@@ -0,0 +1,267 @@
+import pandas as pd
+import numpy as np
+import sys
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Add the root directory (scripts) to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.script_handle_satute_components import (
+    get_dataset_directories,
+    summarize_component_data,
+)
+
+from utils.script_coherence_matrix import (
+    calculate_variance_from_matrix,
+    get_branch_category_codes,
+    get_branch_coherence,
+    get_branch_present_sites,
+    get_coherence_matrix,
+    select_branches,
+)
+
+from utils.script_analyses_utils import (
+    get_regions_from_annotation
+)
+
+from branch_specific_sliding_window_analysis.script_sliding_window_analysis import (
+    calculate_window_zscore_matrix,
+)
+
+
+""" Null distributions by shuffling sites within rate categories """
+
+def permute_within_categories(values, category_codes, number_of_replicates, rng, block_size=1):
+    """
+    Draws replicates of a coherence track with the sites shuffled within their rate categories.
+
+    With a block_size larger than 1, the sites of each category (in site order) are cut into
+    consecutive blocks, and whole blocks are shuffled, which keeps short-range autocorrelation.
+
+    Args:
+        values (np.ndarray): Coherence coefficients of one branch in site order.
+        category_codes (np.ndarray): Rate category code of every site.
+        number_of_replicates (int): Number of replicates.
+        rng (np.random.Generator): Random number generator.
+        block_size (int, optional): Number of sites per block. Default is 1 (plain permutation).
+
+    Returns:
+        np.ndarray: The replicates, one row per replicate.
+    """
+    replicates = np.empty((number_of_replicates, len(values)))
+    for category in np.unique(category_codes):
+        positions = np.flatnonzero(category_codes == category)
+        ranks = np.arange(len(positions))
+        blocks = ranks // block_size
+        number_of_blocks = blocks[-1] + 1
+
+        # Random order of the blocks, the sites of a block stay together
+        block_order = np.argsort(rng.random((number_of_replicates, number_of_blocks)), axis=1)
+        block_position = np.argsort(block_order, axis=1)
+        sort_keys = block_position[:, blocks] * block_size + ranks % block_size
+        source = np.argsort(sort_keys, axis=1)
+
+        replicates[:, positions] = values[positions][source]
+    return replicates
+
+
+def calculate_permuted_region_zscores(tracks, variance, region_indices):
+    # Region z-scores of every track (row), regions without sites are NaN
+    region_zscores = np.full((tracks.shape[0], len(region_indices)), np.nan)
+    for column, indices in enumerate(region_indices):
+        if len(indices) > 0:
+            region_zscores[:, column] = tracks[:, indices].mean(axis=1) / np.sqrt(variance / len(indices))
+    return region_zscores
+
+
+def calculate_permutation_counts(values, category_codes, variance, window_size, region_indices, number_of_replicates, seed_sequence, block_size=1, batch_size=100):
+    """
+    Counts how often the replicates of a branch reach the observed statistics or lower.
+
+    Runs in a worker process, the replicates are drawn from an independent stream of seed_sequence
+    and evaluated in batches, so memory does not grow with the number of replicates.
+
+    Args:
+        values (np.ndarray): Coherence coefficients of one branch in site order.
+        category_codes (np.ndarray): Rate category code of every site.
+        variance (float): Variance of the branch, unchanged by shuffling within categories.
+        window_size (int): Number of sites per window.
+        region_indices (list of np.ndarray): Positions of the sites of every region in values.
+        number_of_replicates (int): Number of replicates.
+        seed_sequence (np.random.SeedSequence): Seed of the random stream.
+        block_size (int, optional): Number of sites per shuffled block. Default is 1.
+        batch_size (int, optional): Number of replicates evaluated at once. Default is 100.
+
+    Returns:
+        dict: Counts of replicates with a window z-score ("window"), region z-score ("region")
+        and minimal window z-score ("branch") at or below the observed value.
+    """
+    rng = np.random.default_rng(seed_sequence)
+    observed = values[np.newaxis, :]
+    observed_windows = calculate_window_zscore_matrix(observed, np.array([variance]), window_size)[0]
+    observed_regions = calculate_permuted_region_zscores(observed, variance, region_indices)[0]
+    observed_minimum = np.nanmin(observed_windows) if not np.isnan(observed_windows).all() else np.nan
+
+    counts = {
+        "window": np.zeros(len(values), dtype=np.int64),
+        "region": np.zeros(len(region_indices), dtype=np.int64),
+        "branch": 0,
+    }
+    for start in range(0, number_of_replicates, batch_size):
+        replicates = permute_within_categories(
+            values, category_codes, min(batch_size, number_of_replicates - start), rng, block_size
+        )
+        window_zscores = calculate_window_zscore_matrix(
+            replicates, np.full(len(replicates), variance), window_size
+        )
+        counts["window"] += (window_zscores <= observed_windows).sum(axis=0)
+        counts["region"] += (calculate_permuted_region_zscores(replicates, variance, region_indices) <= observed_regions).sum(axis=0)
+        if not np.isnan(observed_minimum):
+            counts["branch"] += int((np.nanmin(window_zscores, axis=1) <= observed_minimum).sum())
+
+    counts["observed_windows"] = observed_windows
+    counts["observed_regions"] = observed_regions
+    counts["observed_minimum"] = observed_minimum
+    return counts
+
+
+def get_empirical_pvalues(counts, number_of_replicates, observed):
+    # Lower tail, the observed value counts as one replicate; undefined statistics stay NaN
+    pvalues = (1 + np.asarray(counts, dtype=np.float64)) / (number_of_replicates + 1)
+    return np.where(np.isnan(observed), np.nan, pvalues)
+
+
+def permutation_null_analysis(satute_input_dir, window_size, annotation_file=None, number_of_replicates=1000, block_size=1, edge_list=None, results_dir=None, data_name=None, workers=None, seed=None, batch_size=100):
+    """
+    Empirical p-values of the window and region z-scores from shuffling sites within rate categories.
+
+    The replicates of every branch are split into batches that run in a process pool. Every batch
+    draws from its own random stream, spawned from one SeedSequence, so the results only depend on
+    seed and not on the number of workers. The p-values are lower-tailed: small values mean lower
+    phylogenetic signal than expected under the null. For every branch, the minimal window z-score
+    is also tested against the minima of the replicates.
+
+    The results are saved in results_dir as <dataset>_window_pvalues_size_<window_size>.csv (one column
+    per branch), <dataset>_region_pvalues.csv (if an annotation file is given) and
+    <data_name>_branch_pvalues_size_<window_size>.csv.
+
+    Args:
+        satute_input_dir (str): Directory with the SatuTe output, optionally one subfolder per dataset.
+        window_size (int): Number of sites per window.
+        annotation_file (str, optional): Region annotation file (site, region_name). If None, no region p-values.
+        number_of_replicates (int, optional): Number of replicates per branch. Default is 1000.
+        block_size (int, optional): Number of consecutive sites of a category shuffled together. Default is 1.
+        edge_list (list, optional): List of branches to include. If None, include all branches.
+        results_dir (str, optional): Output directory. If None, satute_input_dir is used.
+        data_name (str, optional): Name of the output files. If None, the name of satute_input_dir is used.
+        workers (int, optional): Number of worker processes. If None, the number of processors.
+        seed (int, optional): Seed of the random streams. If None, fresh entropy is used.
+        batch_size (int, optional): Number of replicates per task. Default is 100.
+
+    Returns:
+        DataFrame: Minimal window z-score and its p-value per dataset and branch.
+    """
+    if results_dir is None:
+        results_dir = satute_input_dir
+    if data_name is None:
+        data_name = os.path.basename(satute_input_dir)
+
+    region_info = get_regions_from_annotation(annotation_file) if annotation_file is not None else {}
+    summarized_component_data_dict = summarize_component_data(satute_input_dir, results_dir, data_name, edge_list=edge_list)
+
+    # Branches of every dataset in sorted order, read from the memory-mapped coherence matrix of its directory
+    directories = dict(get_dataset_directories(satute_input_dir))
+    branches = []
+    for dataset, component_data in summarized_component_data_dict.items():
+        matrix = get_coherence_matrix(
+            directories[dataset], results_dir, dataset, component_data=component_data if edge_list is None else None
+        )
+        branches.extend((dataset, branch, matrix) for branch in select_branches(matrix, edge_list)[0])
+    root_seed_sequence = np.random.SeedSequence(seed)
+    number_of_batches = -(-number_of_replicates // batch_size)
+    branch_seed_sequences = root_seed_sequence.spawn(len(branches))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for (dataset, branch, matrix), branch_seed_sequence in zip(branches, branch_seed_sequences):
+            values = np.array(get_branch_coherence(matrix, branch), dtype=np.float64)
+            category_codes = pd.factorize(get_branch_category_codes(matrix, branch))[0]
+            variance = calculate_variance_from_matrix(matrix, branch)
+
+            # Positions of the region sites in the track of the branch, as in calculate_zscore_per_region
+            site_to_index = {site: index for index, site in enumerate(get_branch_present_sites(matrix, branch).tolist())}
+            region_indices = [
+                np.array([site_to_index[site] for site in sites if site in site_to_index], dtype=np.int64)
+                for sites in region_info.values()
+            ]
+
+            branch_futures = [
+                executor.submit(
+                    calculate_permutation_counts, values, category_codes, variance, window_size, region_indices,
+                    min(batch_size, number_of_replicates - batch * batch_size), batch_seed_sequence, block_size, batch_size,
+                )
+                for batch, batch_seed_sequence in enumerate(branch_seed_sequence.spawn(number_of_batches))
+            ]
+            futures.append((dataset, branch, branch_futures))
+
+        window_pvalues, region_pvalues, branch_pvalues = {}, {}, []
+        for dataset, branch, branch_futures in futures:
+            batch_counts = [future.result() for future in branch_futures]
+            observed = batch_counts[0]
+
+            window_counts = sum(counts["window"] for counts in batch_counts)
+            window_pvalues.setdefault(dataset, {})[branch] = get_empirical_pvalues(
+                window_counts, number_of_replicates, observed["observed_windows"]
+            )
+            if region_info:
+                region_counts = sum(counts["region"] for counts in batch_counts)
+                region_pvalues.setdefault(dataset, {})[branch] = get_empirical_pvalues(
+                    region_counts, number_of_replicates, observed["observed_regions"]
+                )
+            branch_counts = sum(counts["branch"] for counts in batch_counts)
+            branch_pvalues.append({
+                'dataset': dataset,
+                'branch': branch,
+                'min_window_zscore': observed["observed_minimum"],
+                'pvalue': get_empirical_pvalues(branch_counts, number_of_replicates, observed["observed_minimum"]).item(),
+            })
+
+    for dataset, pvalues in window_pvalues.items():
+        window_df = pd.DataFrame({branch: pd.Series(pvalues[branch]) for branch in sorted(pvalues)})
+        window_df.to_csv(os.path.join(results_dir, f"{dataset}_window_pvalues_size_{window_size}.csv"), index=False)
+
+    for dataset, pvalues in region_pvalues.items():
+        region_df = pd.DataFrame({'region': list(region_info)})
+        for branch in sorted(pvalues):
+            region_df[branch] = pvalues[branch]
+        region_df.to_csv(os.path.join(results_dir, f"{dataset}_region_pvalues.csv"), index=False)
+
+    branch_pvalues_df = pd.DataFrame(branch_pvalues, columns=['dataset', 'branch', 'min_window_zscore', 'pvalue'])
+    branch_pvalues_df.to_csv(os.path.join(results_dir, f"{data_name}_branch_pvalues_size_{window_size}.csv"), index=False)
+
+    return branch_pvalues_df
+
+
+if __name__ == "__main__":
+
+    # Get the current working directory
+    current_directory = os.getcwd()
+
+    region_annotation_file = os.path.join(current_directory, "../../example/data/region_annotation.csv")
+
+    """ Permutation null for specific branches """
+
+    data_name = "example_specific_branches"
+
+    # Specify the path to your considered  input data
+    input_dir = os.path.join(current_directory, "../../example/SatuTe_without_rate_heterogeneity")
+
+    # Specify the path to output
+    output_dir = os.path.join(current_directory, "../../example/results_permutation_null_analysis/", data_name)
+    os.makedirs(output_dir, exist_ok=True)
+
+    permutation_null_analysis(
+        input_dir, window_size=36, annotation_file=region_annotation_file, number_of_replicates=1000,
+        edge_list=["(A1, Node1*)", "(Node4*, Node2*)"], results_dir=output_dir, seed=42,
+    )
@@ -12,6 +12,7 @@ python=python3
 cd branch_specific_sliding_window_analysis/
 $python  script_sliding_window_analysis.py
 $python  script_visualise_results.py 
+$python  script_saturated_segments.py
 
 # per category analyses
 cd ../per_category_analysis/
@@ -21,6 +22,10 @@ $python script_category_analysis.py
 cd ../per_alignment_region_analysis
 $python script_per_region_analysis.py
 
+# permutation null distribution of window and region z-scores
+cd ../permutation_null_analysis
+$python script_permutation_null_analysis.py
+
 #missing separate analysis
 
 # z-score differences between  branches
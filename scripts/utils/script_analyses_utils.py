@@ -1,11 +1,23 @@
 import os
+import re
+import csv
 import subprocess
+import numpy as np
+import pandas as pd
+from typing import NamedTuple
+
+from utils.script_handle_data import get_file_sha256
 
 
    
-def find_fasta_file(gene_name, source_folder):
+def list_file_names(directory, file_names=None):
+    # File names already known (e.g. from a SatuteRun) avoid scanning the directory again
+    return os.listdir(directory) if file_names is None else file_names
+
+
+def find_fasta_file(gene_name, source_folder, file_names=None):
     # Iterate over files in the source folder
-    for filename in os.listdir(source_folder):
+    for filename in list_file_names(source_folder, file_names):
         if gene_name in filename and filename.endswith(".fasta"):
             return os.path.join(source_folder, filename)
     return None
@@ -13,51 +25,377 @@ def find_fasta_file(gene_name, source_folder):
 def run_external_command(command_args):
     subprocess.run(command_args)
 
-def find_tree_file(gene_name, source_folder):
+def find_tree_file(gene_name, source_folder, file_names=None):
     # Iterate over files in the source folder
-    for filename in os.listdir(source_folder):
+    for filename in list_file_names(source_folder, file_names):
         if gene_name in filename and filename.endswith(".treefile"):
             return os.path.join(source_folder, filename)
     return None
 
-def find_file_with_suffix(gene_name, suffix, source_folder):
+def find_file_with_suffix(gene_name, suffix, source_folder, file_names=None):
     # Iterate over files in the source folder
-    for filename in os.listdir(source_folder):
+    for filename in list_file_names(source_folder, file_names):
         if gene_name in filename and filename.endswith(suffix):
             return os.path.join(source_folder, filename)
     return None
 
 
-def find_files_with_suffix_in_directory(suffix, directory):
+def find_files_with_suffix_in_directory(suffix, directory, file_names=None):
     """
     Finds all files with the specified suffix in the given directory.
 
     Args:
         suffix (str): The suffix to look for (e.g., "_size_36.csv").
         directory (str): The directory to search in.
+        file_names (list, optional): Names of the files of the directory, if already known. If None, the directory is scanned.
 
     Returns:
         list of str: List of file paths matching the suffix.
     """
-    return [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(suffix)]
+    return [os.path.join(directory, f) for f in list_file_names(directory, file_names) if f.endswith(suffix)]
 
 
-def find_file_with_suffix_in_directory(suffix, source_folder):
+def find_file_with_suffix_in_directory(suffix, source_folder, file_names=None):
     # Iterate over files in the source folder
-    for filename in os.listdir(source_folder):
+    for filename in list_file_names(source_folder, file_names):
         if filename.endswith(suffix):
             return os.path.join(source_folder, filename)
     return None
 
 
-def get_regions_from_annotation(annotation_file):
-    # Read the annotation file to get site and region_name information
-    region_info = {}
+class RegionAnnotation(NamedTuple):
+    """
+    A parsed region annotation file.
+
+    Attributes:
+        regions (list): Region names in order of their first appearance.
+        region_sites (dict): Region name to the sites of the region (read-only int32 array, in file order).
+        sites (np.ndarray): Site of every line of the file (int32).
+        region_codes (np.ndarray): Index in regions of every line of the file (int32).
+        site_to_region (np.ndarray): Region code of every site up to the largest annotated site, -1 for
+            sites without a region. A site annotated several times gets the region of its last line.
+    """
+    regions: list
+    region_sites: dict
+    sites: np.ndarray
+    region_codes: np.ndarray
+    site_to_region: np.ndarray
+
+
+# Parsed annotation files by SHA-256 of their content
+REGION_ANNOTATION_CACHE = {}
+
+
+def load_region_annotation(annotation_file):
+    """
+    Reads a region annotation file (header, then site,region_name per line) in bulk.
+
+    The parsed annotation is cached by the hash of the file content, so scripts reading the same
+    annotation again, or a copy of it, only parse it once.
+
+    Args:
+        annotation_file (str): Path to the annotation file.
+
+    Returns:
+        RegionAnnotation: The parsed annotation, its arrays are read-only.
+    """
+    content_hash = get_file_sha256(annotation_file)
+    if content_hash in REGION_ANNOTATION_CACHE:
+        return REGION_ANNOTATION_CACHE[content_hash]
+
+    # Quotes are stripped from the region names rather than parsed, e.g. "R2""" is R2
+    annotation = pd.read_csv(
+        annotation_file, header=0, names=["site", "region_name"],
+        dtype={"site": np.int64, "region_name": str}, keep_default_na=False, quoting=csv.QUOTE_NONE,
+    )
+    region_names = annotation["region_name"].str.strip().str.strip('"')
+    codes, regions = pd.factorize(region_names.to_numpy())
+    sites = annotation["site"].to_numpy().astype(np.int32)
+    region_codes = codes.astype(np.int32)
+
+    # Stable sort by region keeps the file order of the sites within a region
+    order = np.argsort(region_codes, kind="stable")
+    boundaries = np.searchsorted(region_codes[order], np.arange(len(regions) + 1))
+    region_sites = {}
+    for code, region in enumerate(regions):
+        region_sites[region] = sites[order[boundaries[code]:boundaries[code + 1]]]
+
+    site_to_region = np.full(sites.max() + 1 if len(sites) else 0, -1, dtype=np.int32)
+    site_to_region[sites] = region_codes
+
+    for array in [sites, region_codes, site_to_region, *region_sites.values()]:
+        array.setflags(write=False)
+
+    region_annotation = RegionAnnotation(list(regions), region_sites, sites, region_codes, site_to_region)
+    REGION_ANNOTATION_CACHE[content_hash] = region_annotation
+    return region_annotation
+
+
+""" Partition files: NEXUS charset / charpartition blocks and RAxML-style IQ-TREE partition files """
+
+class RegionIntervals(NamedTuple):
+    """
+    Regions of a partition file as sorted interval arrays.
+
+    Attributes:
+        regions (list): Region names in order of their definition.
+        starts (np.ndarray): First site of every interval (int64), sorted by region and start.
+        ends (np.ndarray): Last site (inclusive) of every interval (int64).
+        region_codes (np.ndarray): Index in regions of every interval (int64).
+    """
+    regions: list
+    starts: np.ndarray
+    ends: np.ndarray
+    region_codes: np.ndarray
+
+
+# Parsed partition files by SHA-256 of their content and number of sites
+REGION_INTERVALS_CACHE = {}
+
+NEXUS_COMMENT_PATTERN = re.compile(r"\[[^\]]*\]")
+
+# Quoted NEXUS names may contain whitespace, commas and colons
+NEXUS_TOKEN_PATTERN = re.compile(r"'(?:[^']|'')*'|\"[^\"]*\"|[^\s,'\"]+")
+NEXUS_ITEM_PATTERN = re.compile(r"(?:'(?:[^']|'')*'|\"[^\"]*\"|[^,'\"])+")
+NEXUS_LABEL_PATTERN = re.compile(r"\s*((?:'(?:[^']|'')*'|\"[^\"]*\"|[^:'\"])*):(.*)", re.DOTALL)
+NEXUS_NCHAR_PATTERN = re.compile(r"\bnchar\s*=\s*(\d+)", re.IGNORECASE)
+
+# Substitution models of IQ-TREE, the labels of the subsets of its charpartitions
+IQTREE_MODEL_NAMES = {
+    "jc", "jc69", "f81", "k80", "k2p", "hky", "hky85", "tn", "tn93", "tne", "k81", "k3p", "k81u", "tpm2", "tpm2u",
+    "tpm3", "tpm3u", "tim", "time", "tim2", "tim2e", "tim3", "tim3e", "tvm", "tvme", "sym", "gtr",
+    "poisson", "lg", "wag", "jtt", "jttdcmut", "dayhoff", "dcmut", "mtrev", "mtart", "mtmam", "cprev", "rtrev",
+    "vt", "blosum62", "pmb", "hivb", "hivw", "flu", "mtzoa", "mtmet", "mtver", "mtinv", "gtr20", "mfp", "test",
+}
+
+
+def unquote_nexus_name(name):
+    # 'gene 2' -> gene 2, a doubled quote inside single quotes stands for one quote
+    name = name.strip()
+    if len(name) >= 2 and name[0] == name[-1] == "'":
+        return name[1:-1].replace("''", "'")
+    return name.strip('"')
+
+
+def add_partition_region(partition, name, ranges):
+    if name in partition:
+        raise ValueError(f"Region defined more than once in partition file: {name}")
+    partition[name] = ranges
+
+
+def get_partition_format(annotation_file):
+    """
+    Detects the format of a region annotation file from its first non-empty line.
+
+    Args:
+        annotation_file (str): Path to the annotation file.
+
+    Returns:
+        str: "nexus" for NEXUS files, "raxml" for RAxML-style partition files (MODEL, name = ranges)
+        and "csv" for per-site annotations (site, region_name).
+    """
     with open(annotation_file) as f:
-        next(f)  # Skip header
         for line in f:
-            site, region_name = line.strip().split(",")
-            site = int(site)
-            region_name = region_name.strip('"')
-            region_info[region_name] = region_info.get(region_name, []) + [site]
-    return region_info
\ No newline at end of file
+            line = line.strip()
+            if not line:
+                continue
+            if line.lower().startswith("#nexus"):
+                return "nexus"
+            return "raxml" if "=" in line else "csv"
+    return "csv"
+
+
+def parse_partition_ranges(range_specification, named_ranges=None, number_of_sites=None):
+    """
+    Parses the ranges of a charset or partition, e.g. "1-100 201-300\\3, 400" or "2-.\\3".
+
+    Ranges with a stride are expanded into single sites. Names of earlier charsets, quoted if they
+    contain whitespace, are replaced by their ranges. "." stands for the last site of the alignment.
+
+    Args:
+        range_specification (str): The ranges, separated by whitespace or commas.
+        named_ranges (dict, optional): Charset name to its list of (start, end) ranges.
+        number_of_sites (int, optional): Number of sites of the alignment, the value of ".".
+
+    Returns:
+        list: The (start, end) ranges, end inclusive.
+
+    Raises:
+        ValueError: If a range is not understood, or if "." is used without number_of_sites.
+    """
+    # "1 - 100 \ 3" -> "1-100\3", quoted names are left as they are
+    range_specification = re.sub(
+        r"'(?:[^']|'')*'|\"[^\"]*\"|[^'\"]+",
+        lambda part: part.group() if part.group()[0] in "'\"" else re.sub(r"\s*\\\s*", r"\\", re.sub(r"\s*-\s*", "-", part.group())),
+        range_specification,
+    )
+
+    ranges = []
+    for token in NEXUS_TOKEN_PATTERN.findall(range_specification):
+        if named_ranges is not None and unquote_nexus_name(token) in named_ranges:
+            ranges.extend(named_ranges[unquote_nexus_name(token)])
+            continue
+        ranges.extend(parse_partition_range(token, number_of_sites))
+    return ranges
+
+
+def parse_partition_range(token, number_of_sites=None):
+    # A single range "start", "start-end" or "start-end\stride", end may be "."
+    match = re.fullmatch(r"(\d+)(?:-(\d+|\.))?(?:\\(\d+))?", token)
+    if match is None:
+        raise ValueError(f"Range not supported in partition file: {token}")
+    start = int(match.group(1))
+    if match.group(2) == ".":
+        if number_of_sites is None:
+            raise ValueError(f"Range {token} ends at the end of the alignment ('.'), but the number of sites is unknown. "
+                             "Add nchar to the partition file or pass number_of_sites.")
+        end = number_of_sites
+    else:
+        end = int(match.group(2)) if match.group(2) else start
+    stride = int(match.group(3)) if match.group(3) else 1
+    if stride == 1:
+        return [(start, end)]
+    return [(site, site) for site in range(start, end + 1, stride)]
+
+
+def is_iqtree_model(label):
+    # "GTR+F+G4", "LG{0.1}+I" or "Q.pfam+R4": the base model comes before the first "+" or "{"
+    base_model = re.split(r"[+{]", label.strip(), 1)[0].lower()
+    return base_model in IQTREE_MODEL_NAMES or base_model.startswith("q.")
+
+
+def parse_nexus_partition(annotation_file, number_of_sites=None):
+    """
+    Reads the regions of a NEXUS partition file: the subsets of the first charpartition if there is one,
+    otherwise all charsets.
+
+    Subsets of a charpartition are "name: ranges" or "name: charset" and the region is named after the
+    label, e.g. "first" for "first: cs1". Only in the IQ-TREE form "model: charset"
+    (e.g. "charpartition mine = GTR+G: part1, GTR+G: part2;") the region is named after the charset,
+    so several regions may share a model.
+
+    Args:
+        annotation_file (str): Path to the NEXUS file.
+        number_of_sites (int, optional): Number of sites of the alignment, for ranges ending in ".".
+            If None, nchar of a DIMENSIONS statement is used if the file has one.
+
+    Returns:
+        dict: Region name to its list of (start, end) ranges.
+
+    Raises:
+        ValueError: If a region is defined more than once or a range is not understood.
+    """
+    with open(annotation_file) as f:
+        content = NEXUS_COMMENT_PATTERN.sub("", f.read())
+
+    if number_of_sites is None:
+        nchar = NEXUS_NCHAR_PATTERN.search(content)
+        number_of_sites = int(nchar.group(1)) if nchar else None
+
+    charsets = {}
+    charpartition = None
+    for statement in content.split(";"):
+        statement = statement.strip()
+        keyword = statement.split(None, 1)[0].lower() if statement else ""
+        if keyword not in ("charset", "charpartition") or "=" not in statement:
+            continue
+        name, range_specification = statement.split(None, 1)[1].split("=", 1)
+        name = unquote_nexus_name(name)
+
+        if keyword == "charset":
+            # IQ-TREE allows an alignment file before the ranges, e.g. "aln.phy: 1-100"
+            label = NEXUS_LABEL_PATTERN.fullmatch(range_specification)
+            if label is not None:
+                range_specification = label.group(2)
+            add_partition_region(charsets, name, parse_partition_ranges(range_specification, charsets, number_of_sites))
+        elif charpartition is None:
+            charpartition = {}
+            for subset in NEXUS_ITEM_PATTERN.findall(range_specification):
+                label = NEXUS_LABEL_PATTERN.fullmatch(subset)
+                if label is None:
+                    continue
+                subset_name, subset_ranges = label.groups()
+                tokens = [unquote_nexus_name(token) for token in NEXUS_TOKEN_PATTERN.findall(subset_ranges)]
+                if len(tokens) == 1 and tokens[0] in charsets and is_iqtree_model(unquote_nexus_name(subset_name)):
+                    # "model: charset", the region is the charset
+                    add_partition_region(charpartition, tokens[0], charsets[tokens[0]])
+                else:
+                    add_partition_region(
+                        charpartition, unquote_nexus_name(subset_name),
+                        parse_partition_ranges(subset_ranges, charsets, number_of_sites),
+                    )
+
+    return charpartition if charpartition is not None else charsets
+
+
+def parse_raxml_partition(annotation_file, number_of_sites=None):
+    # Lines "MODEL, name = ranges" (the model is optional), a region must not be defined twice
+    partition = {}
+    with open(annotation_file) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if "=" not in line:
+                continue
+            name, range_specification = line.split("=", 1)
+            name = name.split(",")[-1].strip()
+            add_partition_region(partition, name, parse_partition_ranges(range_specification, number_of_sites=number_of_sites))
+    return partition
+
+
+def load_region_intervals(annotation_file, number_of_sites=None):
+    """
+    Reads the regions of a NEXUS or RAxML-style partition file as sorted interval arrays.
+
+    The parsed intervals are cached by the hash of the file content.
+
+    Args:
+        annotation_file (str): Path to the partition file.
+        number_of_sites (int, optional): Number of sites of the alignment, for ranges ending in "."
+            (see parse_nexus_partition).
+
+    Returns:
+        RegionIntervals: The intervals, or None if the file is a per-site annotation (see get_partition_format).
+    """
+    partition_format = get_partition_format(annotation_file)
+    if partition_format == "csv":
+        return None
+
+    cache_key = (get_file_sha256(annotation_file), number_of_sites)
+    if cache_key in REGION_INTERVALS_CACHE:
+        return REGION_INTERVALS_CACHE[cache_key]
+
+    if partition_format == "nexus":
+        partition = parse_nexus_partition(annotation_file, number_of_sites)
+    else:
+        partition = parse_raxml_partition(annotation_file, number_of_sites)
+
+    regions = list(partition)
+    region_codes = np.concatenate([np.full(len(ranges), code, dtype=np.int64) for code, ranges in enumerate(partition.values())] or [np.array([], dtype=np.int64)])
+    ranges = np.array([site_range for ranges in partition.values() for site_range in ranges], dtype=np.int64).reshape(-1, 2)
+
+    order = np.lexsort((ranges[:, 0], region_codes))
+    region_intervals = RegionIntervals(regions, ranges[order, 0], ranges[order, 1], region_codes[order])
+    for array in region_intervals[1:]:
+        array.setflags(write=False)
+
+    REGION_INTERVALS_CACHE[cache_key] = region_intervals
+    return region_intervals
+
+
+def get_sites_from_intervals(region_intervals):
+    # Region name to the sites of its intervals (int32), in interval order
+    region_sites = {region: [] for region in region_intervals.regions}
+    for start, end, code in zip(region_intervals.starts, region_intervals.ends, region_intervals.region_codes):
+        region_sites[region_intervals.regions[code]].append(np.arange(start, end + 1, dtype=np.int32))
+    return {
+        region: np.concatenate(site_arrays) if site_arrays else np.array([], dtype=np.int32)
+        for region, site_arrays in region_sites.items()
+    }
+
+
+def get_regions_from_annotation(annotation_file, number_of_sites=None):
+    # Region name to the sites of the region, see load_region_annotation and load_region_intervals
+    region_intervals = load_region_intervals(annotation_file, number_of_sites)
+    if region_intervals is not None:
+        return get_sites_from_intervals(region_intervals)
+    return load_region_annotation(annotation_file).region_sites
@@ -0,0 +1,326 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from typing import NamedTuple
+
+from utils.script_handle_data import (
+    get_file_signature,
+)
+
+from utils.script_satute_run import (
+    get_satute_run,
+)
+
+
+class CoherenceMatrix(NamedTuple):
+    """
+    Dense branch x site representation of the component data of one SatuTe output directory.
+
+    Attributes:
+        coherence (np.ndarray): Memory-mapped matrix of coherence coefficients, one row per branch
+            and one column per site from first_site to the last site. Sites without data for a branch are NaN.
+        present (np.ndarray): Memory-mapped mask, True where a branch has data for a site, so that
+            missing sites can be told apart from NaN coherence values.
+        branches (np.ndarray): Branch dictionary, the label of each row (sorted).
+        categories (np.ndarray): Rate category dictionary.
+        site_category (np.ndarray): Rate category code of each column, -1 for sites without data.
+        category_variance (np.ndarray): Variance per (branch, rate category), NaN if not available.
+        first_site (int): Site of the first column.
+    """
+    coherence: np.ndarray
+    present: np.ndarray
+    branches: np.ndarray
+    categories: np.ndarray
+    site_category: np.ndarray
+    category_variance: np.ndarray
+    first_site: int
+
+
+def get_coherence_matrix_paths(output_dir, dataset_name):
+    prefix = os.path.join(output_dir, f"{dataset_name}_coherence_matrix")
+    return f"{prefix}.npy", f"{prefix}_present.npy", f"{prefix}.npz"
+
+
+def get_components_signatures(directory_path):
+    file_suffix = ".components.csv"
+    component_files = sorted(f for f in os.listdir(directory_path) if f.endswith(file_suffix))
+    return [list(get_file_signature(os.path.join(directory_path, f))) for f in component_files]
+
+
+def open_matrix(matrix_path, dtype, shape, fill_value):
+    # In memory without a path, otherwise written to a .npy file and memory-mapped
+    if matrix_path is None:
+        return np.full(shape, fill_value, dtype=dtype)
+    matrix = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=dtype, shape=shape)
+    matrix[:] = fill_value
+    return matrix
+
+
+def coherence_matrix_from_dataframe(component_data, matrix_path=None, present_path=None, dtype="float64"):
+    """
+    Arranges long-format component data as a branch x site matrix.
+
+    Args:
+        component_data (DataFrame): Component data of one dataset, all branches.
+        matrix_path (str, optional): If given, the coherence matrix is written to this .npy file and memory-mapped.
+        present_path (str, optional): If given, the presence mask is written to this .npy file and memory-mapped.
+        dtype (str, optional): Type of the coherence values. Default is "float64".
+
+    Returns:
+        CoherenceMatrix: The matrix and its side arrays.
+
+    Raises:
+        ValueError: If a site is assigned to different rate categories for different branches.
+    """
+    # Sorted dictionaries without labels that have no rows
+    branch_column = component_data['branch'].astype('category').cat.remove_unused_categories()
+    category_column = component_data['rate_category'].astype('category').cat.remove_unused_categories()
+    branch_codes = branch_column.cat.codes.to_numpy()
+    category_codes = category_column.cat.codes.to_numpy()
+    branches = np.array(branch_column.cat.categories, dtype=str)
+    categories = np.array(category_column.cat.categories, dtype=str)
+
+    sites = component_data['site'].to_numpy(dtype=np.int64)
+    first_site = int(sites.min()) if len(sites) else 0
+    columns = sites - first_site
+    shape = (len(branches), int(columns.max()) + 1 if len(sites) else 0)
+
+    coherence = open_matrix(matrix_path, dtype, shape, np.nan)
+    coherence[branch_codes, columns] = component_data['coherence'].to_numpy()
+    present = open_matrix(present_path, bool, shape, False)
+    present[branch_codes, columns] = True
+
+    site_category = np.full(shape[1], -1, dtype=np.int16)
+    site_category[columns] = category_codes
+    if not np.array_equal(site_category[columns], category_codes):
+        raise ValueError("Sites are assigned to different rate categories for different branches.")
+
+    category_variance = np.full((len(branches), len(categories)), np.nan)
+    category_variance[branch_codes, category_codes] = component_data['category_variance'].to_numpy()
+
+    for matrix in (coherence, present):
+        if isinstance(matrix, np.memmap):
+            matrix.flush()
+    return CoherenceMatrix(coherence, present, branches, categories, site_category, category_variance, first_site)
+
+
+def build_coherence_matrix(directory_path, output_dir, dataset_name=None, dtype="float64", component_data=None):
+    """
+    Converts the components files of a SatuTe output directory into a memory-mapped coherence matrix.
+
+    The matrix is stored as <dataset_name>_coherence_matrix.npy, the presence mask as
+    <dataset_name>_coherence_matrix_present.npy and the side arrays (branch dictionary, rate categories,
+    site categories, category variances and first site) as <dataset_name>_coherence_matrix.npz in output_dir.
+
+    Args:
+        directory_path (str): Directory containing the .components.csv files.
+        output_dir (str): Directory where the matrix is saved.
+        dataset_name (str, optional): Name of the dataset. If None, the name of directory_path is used.
+        dtype (str, optional): Type of the coherence values. Default is "float64".
+        component_data (DataFrame, optional): The component data of all branches of the directory,
+            if already read. If None, the components files are read.
+
+    Returns:
+        CoherenceMatrix: The matrix, opened read-only, and its side arrays.
+    """
+    if dataset_name is None:
+        dataset_name = os.path.basename(directory_path)
+    matrix_path, present_path, side_arrays_path = get_coherence_matrix_paths(output_dir, dataset_name)
+
+    if component_data is None:
+        component_data = get_satute_run(directory_path).get_component_data(dataset_name, memoize=False)
+    if component_data.empty:
+        raise ValueError(f"No component data found in {directory_path}")
+
+    matrix = coherence_matrix_from_dataframe(component_data, matrix_path, present_path, dtype)
+    np.savez(
+        side_arrays_path,
+        branches=matrix.branches,
+        categories=matrix.categories,
+        site_category=matrix.site_category,
+        category_variance=matrix.category_variance,
+        first_site=np.array(matrix.first_site),
+        sources=np.array(json.dumps(get_components_signatures(directory_path))),
+    )
+    del matrix
+
+    return load_coherence_matrix(output_dir, dataset_name)
+
+
+def load_coherence_matrix(output_dir, dataset_name):
+    """
+    Opens a coherence matrix written by build_coherence_matrix without reading it into memory.
+
+    Args:
+        output_dir (str): Directory containing the matrix.
+        dataset_name (str): Name of the dataset.
+
+    Returns:
+        CoherenceMatrix: The read-only memory-mapped matrix and its side arrays.
+    """
+    matrix_path, present_path, side_arrays_path = get_coherence_matrix_paths(output_dir, dataset_name)
+    with np.load(side_arrays_path) as side_arrays:
+        return CoherenceMatrix(
+            coherence=np.load(matrix_path, mmap_mode="r"),
+            present=np.load(present_path, mmap_mode="r"),
+            branches=side_arrays["branches"],
+            categories=side_arrays["categories"],
+            site_category=side_arrays["site_category"],
+            category_variance=side_arrays["category_variance"],
+            first_site=int(side_arrays["first_site"]),
+        )
+
+
+def get_coherence_matrix(directory_path, output_dir, dataset_name=None, dtype="float64", component_data=None):
+    """
+    Loads the coherence matrix of a SatuTe output directory, building it if it is missing or stale.
+
+    The matrix always holds all branches of the directory, so runs with different edge lists share it.
+
+    Args:
+        directory_path (str): Directory containing the .components.csv files.
+        output_dir (str): Directory where the matrix is saved.
+        dataset_name (str, optional): Name of the dataset. If None, the name of directory_path is used.
+        dtype (str, optional): Type of the coherence values when (re)building. Default is "float64".
+        component_data (DataFrame, optional): The component data of all branches of the directory,
+            if already read, used when the matrix has to be (re)built.
+
+    Returns:
+        CoherenceMatrix: The read-only memory-mapped matrix and its side arrays.
+    """
+    if dataset_name is None:
+        dataset_name = os.path.basename(directory_path)
+
+    if all(os.path.isfile(path) for path in get_coherence_matrix_paths(output_dir, dataset_name)):
+        with np.load(get_coherence_matrix_paths(output_dir, dataset_name)[2]) as side_arrays:
+            sources = json.loads(str(side_arrays["sources"]))
+        if sources == get_components_signatures(directory_path):
+            return load_coherence_matrix(output_dir, dataset_name)
+
+    return build_coherence_matrix(directory_path, output_dir, dataset_name, dtype, component_data)
+
+
+""" Accessors for single branches """
+
+def get_branch_index(matrix, branch):
+    indices = np.flatnonzero(matrix.branches == branch)
+    if len(indices) == 0:
+        raise KeyError(f"Branch not found in coherence matrix: {branch}")
+    return int(indices[0])
+
+
+def get_branch_row(matrix, branch):
+    # A view into the memory-mapped matrix, nothing is copied
+    return matrix.coherence[get_branch_index(matrix, branch)]
+
+
+def get_branch_coherence(matrix, branch):
+    """
+    Returns the coherence coefficients of the sites with data for a branch, in site order.
+
+    This matches the coherence column of the branch in the summarized component data.
+    If the branch has data for every site from first_site to the last site of the dataset,
+    the returned array is a view of the matrix row, otherwise a copy.
+
+    Args:
+        matrix (CoherenceMatrix): The coherence matrix.
+        branch (str): Branch label.
+
+    Returns:
+        np.ndarray: The coherence coefficients of the branch.
+    """
+    row = get_branch_row(matrix, branch)
+    present = matrix.present[get_branch_index(matrix, branch)]
+    return row if present.all() else row[present]
+
+
+def get_branch_present_sites(matrix, branch):
+    # Site of every value of get_branch_coherence
+    return get_site_axis(matrix)[matrix.present[get_branch_index(matrix, branch)]]
+
+
+def get_branch_category_codes(matrix, branch):
+    # Rate category code of every value of get_branch_coherence
+    return matrix.site_category[matrix.present[get_branch_index(matrix, branch)]]
+
+
+def get_branch_category_counts(matrix, branch):
+    return np.bincount(get_branch_category_codes(matrix, branch), minlength=len(matrix.categories))
+
+
+def calculate_variance_from_matrix(matrix, branch):
+    """
+    Computes the variance of a branch from the coherence matrix, as calculate_variance does
+    from the component data: the category variances weighted by the number of sites per category.
+
+    Args:
+        matrix (CoherenceMatrix): The coherence matrix.
+        branch (str): Branch label.
+
+    Returns:
+        float: The variance of the branch.
+    """
+    counts = get_branch_category_counts(matrix, branch)
+    category_variance = matrix.category_variance[get_branch_index(matrix, branch)]
+    sequence_len = counts.sum()
+
+    variance = 0
+    # Same summation order as calculate_variance (most frequent category first)
+    for category in np.argsort(-counts, kind="stable"):
+        if counts[category] > 0:
+            variance += category_variance[category] * counts[category] / sequence_len
+    return variance
+
+
+""" Accessors for all branches """
+
+def get_site_axis(matrix):
+    # Site of every column of the matrix
+    return np.arange(matrix.first_site, matrix.first_site + matrix.coherence.shape[1])
+
+
+def select_branches(matrix, edge_list=None):
+    """
+    Selects the rows of the branches of an analysis, in the (sorted) order of the matrix.
+
+    Without edge_list, the memory-mapped arrays are returned as they are, otherwise
+    only the selected rows are read.
+
+    Args:
+        matrix (CoherenceMatrix): The coherence matrix.
+        edge_list (list, optional): List of branches to include. If None, include all branches.
+
+    Returns:
+        tuple: The branch labels, their coherence rows, presence rows and variances (np.ndarray).
+    """
+    if edge_list is None:
+        rows = np.arange(len(matrix.branches))
+        coherence, present = matrix.coherence, matrix.present
+    else:
+        rows = np.flatnonzero(np.isin(matrix.branches, list(edge_list)))
+        coherence, present = matrix.coherence[rows], matrix.present[rows]
+    branches = matrix.branches[rows].tolist()
+    variances = np.array([calculate_variance_from_matrix(matrix, branch) for branch in branches], dtype=np.float64)
+    return branches, coherence, present, variances
+
+
+def get_rank_matrix(coherence, present):
+    """
+    Arranges the coherence coefficients as a branch x site rank matrix.
+
+    The k-th column holds the k-th site present for every branch, as the per-branch analyses
+    see the rows of the components files. Branches with fewer sites are padded with NaN.
+
+    Args:
+        coherence (np.ndarray): Coherence rows, see select_branches.
+        present (np.ndarray): Presence rows, see select_branches.
+
+    Returns:
+        np.ndarray: The rank matrix.
+    """
+    rows, columns = np.nonzero(present)
+    ranks = np.cumsum(present, axis=1)[rows, columns] - 1
+    rank_matrix = np.full((coherence.shape[0], ranks.max() + 1 if len(ranks) else 0), np.nan)
+    rank_matrix[rows, ranks] = coherence[rows, columns]
+    return rank_matrix
@@ -1,10 +1,16 @@
 import os
-import re
+import numpy as np
 import pandas as pd
 import io
 from pandas import DataFrame
+import json
 import shutil
+import hashlib
+import csv
+import heapq
+from concurrent.futures import ThreadPoolExecutor
 from utils.script_handle_tree import  write_nexus_file
+from utils.script_handle_satute_report import parse_satute_log, parse_satute_report
 
 
 def subdictonary_additional_info(current_dir):
@@ -24,43 +30,13 @@ def subdictonary_additional_info(current_dir):
    
 
 def extract_relative_category_rates_from_satute(file_path):
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-
-    string_table = []
-    # Find the start of the table
-    table = False
-    for  line in lines:
-        if "Category" in line and "Relative_rate" in line:         
-            table = True
-            continue
-            
-        if table: 
-            if "SPECTRAL DECOMPOSITION" in line: 
-                break
-            if line.strip()!= "":
-                string_table.append(line.strip())
-
-    if not table:
+    category_rates = parse_satute_report(file_path)["category_rates"]
+
+    if category_rates is None:
         raise ValueError("Table not found in the file.")
-    
-    # Join the lines into a single string and convert to a DataFrame
-    table_str = '\n'.join(string_table)
-    columns = [
-        "Category", 
-        "Relative_rate", 
-        "Proportion", 
-        "Empirical_Proportion"
-    ]
-    df = pd.read_csv(io.StringIO(table_str), delim_whitespace=True, names=columns)    
-
-    # Select only the first two columns
-    df = df[["Category", "Relative_rate"]]
-
-    # Rename the Category column to c1, c2, ...
-    df["Category"] = ['c{}'.format(i + 1) for i in range(len(df))]
-    
-    return df
+
+    # Copy, the parsed report is cached
+    return category_rates.copy()
 
 def parse_file_to_data_frame(file_path):
     try:
@@ -81,28 +57,45 @@ def get_column_names_with_prefix(data_frame, prefix):
     ].tolist()
     return columns_with_prefix
 
-def build_categories_by_sub_tables(data_frame: DataFrame):
-    rate_category_dictionary = {}
+def build_categories_by_sub_tables(data_frame: DataFrame, return_posterior=False):
+    """
+    Assigns every site of an IQ-TREE .siteprob table to its most probable rate category.
+
+    Args:
+        data_frame (DataFrame): The .siteprob table with the column "Site" and one column p1, p2, ... per category.
+        return_posterior (bool, optional): Also return the posterior probability matrix. Default is False.
 
-    # Assuming you already have a dataframe called 'dataframe'
+    Returns:
+        dict: Category column (p1, p2, ...) to the 0-based indices of its sites (np.int32), in table order.
+        np.ndarray: Only if return_posterior, the posterior probabilities (sites x categories).
+    """
     # Call the get_columns_with_prefix function to retrieve columns with a specific prefix
     prefix = "p"  # Specify the desired prefix
 
     columns_with_prefix = get_column_names_with_prefix(data_frame, prefix)
 
-    # Create dictionaries using column names with the specified prefix as names
-    rate_category_dictionary = {column: [] for column in columns_with_prefix}
+    posterior = data_frame[columns_with_prefix].to_numpy(dtype=np.float64)
+    sites = data_frame["Site"].to_numpy().astype(np.int32) - 1
 
-    for index, row in data_frame.iterrows():
-        p_row = row.filter(like="p")
+    # argmax picks the first maximum like idxmax, missing probabilities are skipped
+    best_category = np.argmax(np.where(np.isnan(posterior), -np.inf, posterior), axis=1)
 
-        rate_category_dictionary[p_row.idxmax()].append(int(row["Site"]) - 1)
+    # Sites stay in table order within each category
+    rate_category_dictionary = {
+        column: sites[best_category == index]
+        for index, column in enumerate(columns_with_prefix)
+    }
 
+    if return_posterior:
+        return rate_category_dictionary, posterior
     return rate_category_dictionary
 
-def get_sites_per_category(directory_path):
+def get_sites_per_category(directory_path, file_names=None):
     file_suffix = ".siteprob"
-    log_files = [f for f in os.listdir(directory_path) if f.endswith(file_suffix)]
+    # File names already known (e.g. from a SatuteRun) avoid scanning the directory again
+    if file_names is None:
+        file_names = os.listdir(directory_path)
+    log_files = [f for f in file_names if f.endswith(file_suffix)]
     if log_files:
         log_file = log_files[0]
         site_probability =  parse_file_to_data_frame(os.path.join(directory_path, log_file))
@@ -135,7 +128,7 @@ def extract_rows_with_value(df, column_name, target_value):
 def rearrange_dataframe(summarized_data):
 
     # Rearrange the data frame
-    rearranged_df = summarized_data.groupby('branch').agg(
+    rearranged_df = summarized_data.groupby('branch', observed=True).agg(
         category=pd.NamedAgg(column='rate_category', aggfunc=lambda x: list(x.unique())),
         result_test=pd.NamedAgg(column='decision_test', aggfunc=lambda x: list(x.unique())),
         dataset=pd.NamedAgg(column='dataset', aggfunc=lambda x: list(x.unique())),
@@ -146,7 +139,7 @@ def rearrange_dataframe(summarized_data):
 def rearrange_dataframe_correction(summarized_data):
 
     # Rearrange the data frame
-    rearranged_df = summarized_data.groupby('branch').agg(
+    rearranged_df = summarized_data.groupby('branch', observed=True).agg(
         category=pd.NamedAgg(column='rate_category', aggfunc=lambda x: list(x.unique())),
         result_test=pd.NamedAgg(column='decision_bonferroni_corrected', aggfunc=lambda x: list(x.unique())),
         dataset=pd.NamedAgg(column='dataset', aggfunc=lambda x: list(x.unique())),
@@ -173,17 +166,14 @@ def add_seq_len_category_from_siteprob(data, categorized_sites, directory_path):
 def add_seq_len_category_from_log(data, directory_path):
     file_suffix = ".satute.log"
     log_file = [f for f in os.listdir(directory_path) if f.endswith(file_suffix)][0]
-       
-    with open(os.path.join(directory_path, log_file), 'r') as file:
-        content = file.read()
 
-    category = list(data.loc[:, 'category_rate'])[0]
+    # Site counts of all categories, parsed once per log file
+    sites_per_category = parse_satute_log(os.path.join(directory_path, log_file))["sites_per_category"]
 
-    pattern = re.compile(fr'{re.escape(category)}, Site per category (\d+)')
-    match = pattern.search(content)
+    category = list(data.loc[:, 'category_rate'])[0]
 
-    if match:
-        seq_len = int(match.group(1))
+    if category in sites_per_category:
+        seq_len = sites_per_category[category]
         new_value =f"{category}({seq_len})"
         data.loc[:, 'category_rate'] = new_value
                 
@@ -193,94 +183,665 @@ def add_seq_len_category_from_log(data, directory_path):
     return data
 
 
-def summarize_saturated_results_categories(directory_path, dataset_name):
-    # Initialize an empty DataFrame to store the summarized data
-    summarized_data = pd.DataFrame()
-    summarized_data_corrrection = pd.DataFrame()
+""" Concurrent loading of the per-category SatuTe output files """
+
+SATUTE_RESULTS_DTYPES = {
+    "branch": str,
+    "mean_coherence": "float64",
+    "standard_error_of_mean": "float64",
+    "z_score": "float64",
+    "p_value": "float64",
+    "z_alpha": "float64",
+    "decision_test": str,
+    "z_alpha_bonferroni_corrected": "float64",
+    "decision_bonferroni_corrected": str,
+    "branch_length": "float64",
+    "number_of_sites": "int64",
+    "rate_category": str,
+}
+
+COMPONENTS_DTYPES = {
+    "branch": str,
+    "site": "int64",
+    "coherence": "float64",
+    "category_variance": "float64",
+    "rate_category": str,
+}
+
+
+def read_csv_with_dtypes(file_path, dtypes):
+    """
+    Reads a CSV file with explicit column types.
+
+    Files that do not fit the expected types (e.g. older SatuTe versions writing
+    text into numeric columns) are read again with inferred types.
+
+    Args:
+        file_path (str): Path to the CSV file.
+        dtypes (dict): Column name to dtype mapping.
+
+    Returns:
+        DataFrame: The content of the CSV file.
+    """
+    try:
+        return pd.read_csv(file_path, dtype=dtypes)
+    except (ValueError, TypeError):
+        if hasattr(file_path, "seek"):
+            # In-memory buffers have to be rewound before reading them again
+            file_path.seek(0)
+        return pd.read_csv(file_path)
+
+
+def read_files_concurrently(file_paths, reader, max_workers=None):
+    """
+    Reads several files in a thread pool.
+
+    Args:
+        file_paths (list of str): Paths of the files to read.
+        reader (callable): Function reading a single file path into a DataFrame.
+        max_workers (int, optional): Number of threads. If None, the ThreadPoolExecutor default is used.
+
+    Returns:
+        list of DataFrame: The parsed files, in the order of file_paths.
+    """
+    if len(file_paths) <= 1:
+        return [reader(file_path) for file_path in file_paths]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(reader, file_paths))
+
+
+def list_satute_files(directory_path, file_suffix, file_names=None):
+    # File names already known (e.g. from a SatuteRun) avoid scanning the directory again
+    if file_names is None:
+        file_names = os.listdir(directory_path)
+    satute_result_files = [f for f in file_names if f.endswith(file_suffix)]
+    for file in satute_result_files:
+        print("Processing csv file:", file)
+    return [os.path.join(directory_path, f) for f in satute_result_files]
+
+
+def concat_data_frames(data_frames, **kwargs):
+    # Concatenate once; an empty list gives the same empty DataFrame as before
+    if not data_frames:
+        return pd.DataFrame()
+    return pd.concat(data_frames, **kwargs)
+
 
-    # Get a list of satute results csv files
-    file_suffix = ".satute.csv"
-    satute_result_files = [f for f in os.listdir(directory_path) if f.endswith(file_suffix)]
+def summarize_saturated_results_categories(directory_path, dataset_name, max_workers=None, file_names=None):
+    # Get a list of satute results csv files and read them concurrently
+    file_paths = list_satute_files(directory_path, ".satute.csv", file_names)
+    all_data = read_files_concurrently(
+        file_paths, lambda path: read_csv_with_dtypes(path, SATUTE_RESULTS_DTYPES), max_workers
+    )
+
+    saturated_data = []
+    saturated_data_correction = []
 
     # Summarize the saturated results
-    for file in satute_result_files:
-        # Your specific action goes here
-        print("Processing csv file:", file)
-        
-        # Read CSV file
-        data = pd.read_csv(os.path.join(directory_path, file))
-        
+    for data in all_data:
         # Extract rows with decision "Saturated"
         saturated_rows = extract_rows_of_csv(data)
         saturated_rows_correction = extract_rows_of_csv_correction(data)
 
         if not saturated_rows.empty:
             # Add dataset name
-            #saturated_rows['dataset'] = dataset_name
             saturated_rows.loc[:, 'dataset'] = dataset_name
             saturated_rows_correction.loc[:, 'dataset'] = dataset_name
 
-
             # #add seq_length to category
             # categorized_sites = get_sites_per_category(directory_path)
             # saturated_rows= add_seq_len_category_from_siteprob(saturated_rows, categorized_sites, directory_path)
-            
-            # Append the filtered rows to the summarized data
-            summarized_data = pd.concat([summarized_data, saturated_rows], ignore_index=True)
-            summarized_data_corrrection = pd.concat([summarized_data_corrrection, saturated_rows_correction], ignore_index=True)
 
-    return summarized_data, summarized_data_corrrection
+            saturated_data.append(saturated_rows)
+            saturated_data_correction.append(saturated_rows_correction)
 
-def summarize_z_scores_categories(directory_path, dataset_name):
-    # Initialize an empty DataFrame to store the summarized data
-    zscore_data = pd.DataFrame()
+    summarized_data = concat_data_frames(saturated_data, ignore_index=True)
+    summarized_data_corrrection = concat_data_frames(saturated_data_correction, ignore_index=True)
 
-    # Get a list of satute results csv files
-    file_suffix = ".satute.csv"
-    satute_result_files = [f for f in os.listdir(directory_path) if f.endswith(file_suffix)]
+    return summarized_data, summarized_data_corrrection
 
-    # Summarize the saturated results
-    for file in satute_result_files:
-        # Your specific action goes here
-        print("Processing csv file:", file)
-        
-        # Read CSV file
-        data = pd.read_csv(os.path.join(directory_path, file))
-        
-        
+def summarize_z_scores_categories(directory_path, dataset_name, max_workers=None, file_names=None):
+    # Get a list of satute results csv files and read them concurrently
+    file_paths = list_satute_files(directory_path, ".satute.csv", file_names)
+    all_data = read_files_concurrently(
+        file_paths, lambda path: read_csv_with_dtypes(path, SATUTE_RESULTS_DTYPES), max_workers
+    )
+
+    zscore_data = []
+    for data in all_data:
         filtered_data = data[['branch', 'z_score', 'z_alpha','z_alpha_bonferroni_corrected','number_of_sites', 'rate_category']].copy()
         if not filtered_data.empty:
             # Add dataset name
             filtered_data.loc[:, 'dataset'] = dataset_name
-            zscore_data = pd.concat([zscore_data, filtered_data])
+            zscore_data.append(filtered_data)
+
+    return concat_data_frames(zscore_data)
+
+""" Binary cache for parsed components files """
+
+COMPONENTS_CACHE_SUFFIX = ".cache.npz"
+
+
+def get_components_cache_path(file_path):
+    return file_path + COMPONENTS_CACHE_SUFFIX
+
+
+def get_file_signature(file_path):
+    """
+    Returns the key identifying the current state of a file on disk.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        tuple: Absolute path, size in bytes and modification time in nanoseconds.
+    """
+    stat = os.stat(file_path)
+    return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+
+
+def get_file_sha256(file_path, chunk_size=1024**2):
+    """
+    Computes the SHA-256 hash of the content of a file, reading it in chunks.
+
+    Args:
+        file_path (str): Path to the file.
+        chunk_size (int, optional): Number of bytes read at a time. Default is 1 MB.
+
+    Returns:
+        str: The hexadecimal digest.
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_files_state(directory_path, file_names, previous_files=None):
+    """
+    Records size, modification time and content hash of files of a directory.
+
+    The hash of a file is taken over from previous_files if its size and modification time are unchanged.
+
+    Args:
+        directory_path (str): Directory containing the files.
+        file_names (list): Names of the files, relative to directory_path.
+        previous_files (dict, optional): The state of the files from an earlier call.
+
+    Returns:
+        dict: File name to {"size", "mtime_ns", "sha256"}.
+    """
+    previous_files = previous_files or {}
+    files = {}
+    for file_name in file_names:
+        file_path = os.path.join(directory_path, file_name)
+        stat = os.stat(file_path)
+        previous = previous_files.get(file_name)
+        if previous and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+            sha256 = previous["sha256"]
+        else:
+            sha256 = get_file_sha256(file_path)
+        files[file_name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+    return files
+
+
+def get_content_hashes(files):
+    # A file touched without changing its content keeps its hash
+    return {file_name: state["sha256"] for file_name, state in files.items()}
+
+
+def write_components_cache(data, file_path):
+    """
+    Stores a parsed components file as a columnar .npz sidecar next to the source file.
+
+    String columns are stored as integer codes plus a dictionary of unique values,
+    all other columns as plain NumPy arrays. The sidecar is keyed by the path, size
+    and modification time of the source file.
+
+    Args:
+        data (DataFrame): The parsed content of the components file.
+        file_path (str): Path to the source components file.
+    """
+    source_path, source_size, source_mtime = get_file_signature(file_path)
+    arrays = {
+        "__source_path": np.array(source_path),
+        "__source_size": np.array(source_size),
+        "__source_mtime_ns": np.array(source_mtime),
+        "__columns": np.array(data.columns.tolist(), dtype=str),
+    }
+    for column in data.columns:
+        if data[column].dtype == object:
+            codes, uniques = pd.factorize(data[column])
+            arrays[f"{column}__codes"] = codes.astype(np.int32)
+            arrays[f"{column}__uniques"] = np.array(uniques, dtype=str)
+        else:
+            arrays[column] = data[column].to_numpy()
+
+    # Write to a temporary file first so that a crash never leaves a truncated cache
+    cache_path = get_components_cache_path(file_path)
+    temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as cache_file:
+        np.savez(cache_file, **arrays)
+    os.replace(temporary_path, cache_path)
+
+
+def read_components_cache(file_path):
+    """
+    Loads a components file from its .npz sidecar.
+
+    Args:
+        file_path (str): Path to the source components file.
+
+    Returns:
+        DataFrame or None: The cached data, or None if there is no cache or it is stale.
+    """
+    cache_path = get_components_cache_path(file_path)
+    if not os.path.isfile(cache_path):
+        return None
 
-    return zscore_data
+    try:
+        with np.load(cache_path, allow_pickle=False) as cache:
+            cached_signature = (
+                str(cache["__source_path"]),
+                int(cache["__source_size"]),
+                int(cache["__source_mtime_ns"]),
+            )
+            if cached_signature != get_file_signature(file_path):
+                return None
+
+            columns = {}
+            for column in cache["__columns"].tolist():
+                if f"{column}__codes" in cache.files:
+                    codes = cache[f"{column}__codes"]
+                    values = cache[f"{column}__uniques"].astype(object)[codes]
+                    values[codes < 0] = np.nan
+                    columns[column] = values
+                else:
+                    columns[column] = cache[column]
+    except (OSError, ValueError, KeyError):
+        # Unreadable or incompatible cache, it will be rebuilt
+        return None
+
+    return pd.DataFrame(columns)
+
+
+def read_components_csv(file_path, use_cache=True):
+    """
+    Reads a .satute.components.csv file, using the binary sidecar cache when it is valid.
+
+    A missing or stale cache is rebuilt after parsing the CSV file.
+
+    Args:
+        file_path (str): Path to the components file.
+        use_cache (bool, optional): Whether to read and write the sidecar cache. Default is True.
+
+    Returns:
+        DataFrame: The content of the components file.
+    """
+    if use_cache:
+        data = read_components_cache(file_path)
+        if data is not None:
+            return data
+
+    data = read_csv_with_dtypes(file_path, COMPONENTS_DTYPES)
+
+    if use_cache:
+        try:
+            write_components_cache(data, file_path)
+        except OSError as e:
+            print(f"Could not write cache for {file_path}: {e}")
 
-def summarize_components_categories(directory_path, dataset_name):
-    # Initialize an empty DataFrame to store the summarized data
-    component_data = pd.DataFrame()
+    return data
 
-    # Get a list of satute results csv files
-    file_suffix = ".components.csv"
-    satute_result_files = [f for f in os.listdir(directory_path) if f.endswith(file_suffix)]
 
-    # Summarize the saturated results
-    for file in satute_result_files:
-        # Your specific action goes here
-        print("Processing csv file:", file)
-        
-        # Read CSV file
-        data = pd.read_csv(os.path.join(directory_path, file))
+""" Branch byte-offset index for components files """
+
+BRANCH_INDEX_SUFFIX = ".branch_index.json"
+
+
+def get_branch_index_path(file_path):
+    return file_path + BRANCH_INDEX_SUFFIX
+
+
+def get_branch_label_from_line(line):
+    # The branch label is the first field, quoted since it contains a comma
+    if line.startswith(b'"'):
+        return line[1:line.index(b'"', 1)].decode()
+    return line.split(b",", 1)[0].decode()
+
+
+def build_branch_offset_index(file_path):
+    """
+    Scans a components file once and maps each branch to the byte ranges of its rows.
+
+    Args:
+        file_path (str): Path to the components file.
+
+    Returns:
+        dict: Branch label to a list of [start, end) byte ranges.
+    """
+    branch_ranges = {}
+    current_branch = None
+    with open(file_path, "rb") as file:
+        offset = len(file.readline())  # Skip header
+        start = offset
+        for line in file:
+            if line.strip():
+                branch = get_branch_label_from_line(line)
+                if branch != current_branch:
+                    if current_branch is not None:
+                        branch_ranges.setdefault(current_branch, []).append([start, offset])
+                    current_branch, start = branch, offset
+            offset += len(line)
+
+    if current_branch is not None:
+        branch_ranges.setdefault(current_branch, []).append([start, offset])
+    return branch_ranges
+
+
+def load_branch_offset_index(file_path):
+    """
+    Loads the branch byte-offset index of a components file from its JSON sidecar.
+
+    The index is built and stored the first time a file is seen, and rebuilt when the
+    path, size or modification time of the file changed.
+
+    Args:
+        file_path (str): Path to the components file.
+
+    Returns:
+        dict: Branch label to a list of [start, end) byte ranges.
+    """
+    index_path = get_branch_index_path(file_path)
+    signature = list(get_file_signature(file_path))
+
+    if os.path.isfile(index_path):
+        try:
+            with open(index_path, "r") as index_file:
+                index = json.load(index_file)
+            if index["source"] == signature:
+                return index["branches"]
+        except (OSError, ValueError, KeyError):
+            pass  # Unreadable index, rebuild it
+
+    branch_ranges = build_branch_offset_index(file_path)
+    try:
+        with open(index_path, "w") as index_file:
+            json.dump({"source": signature, "branches": branch_ranges}, index_file)
+    except OSError as e:
+        print(f"Could not write branch index for {file_path}: {e}")
+    return branch_ranges
+
+
+def read_components_csv_for_branches(file_path, branches):
+    """
+    Reads only the rows of the given branches from a components file.
+
+    The byte ranges of the branches are looked up in the branch index, so the rows of
+    all other branches are never parsed. Rows keep their order in the file.
+
+    Args:
+        file_path (str): Path to the components file.
+        branches (list of str): Branch labels to read.
+
+    Returns:
+        DataFrame: The rows of the requested branches.
+    """
+    branch_ranges = load_branch_offset_index(file_path)
+    byte_ranges = sorted(byte_range for branch in set(branches) for byte_range in branch_ranges.get(branch, []))
+
+    with open(file_path, "rb") as file:
+        parts = [file.readline()]  # Header
+        for start, end in byte_ranges:
+            file.seek(start)
+            parts.append(file.read(end - start))
+
+    return read_csv_with_dtypes(io.BytesIO(b"".join(parts)), COMPONENTS_DTYPES)
+
+
+def iter_branch_records_of_file(file_path, branch):
+    """
+    Yields the rows of one branch of a components file as records, reading only its byte ranges.
+
+    Args:
+        file_path (str): Path to the components file.
+        branch (str): Branch label.
+
+    Yields:
+        tuple: Site, coherence, category variance and rate category of each row, in file order.
+    """
+    byte_ranges = load_branch_offset_index(file_path).get(branch, [])
+
+    with open(file_path, "rb") as file:
+        header = next(csv.reader([file.readline().decode()]))
+        site_column, coherence_column, variance_column, category_column = (
+            header.index(column) for column in ["site", "coherence", "category_variance", "rate_category"]
+        )
+        for start, end in sorted(byte_ranges):
+            file.seek(start)
+            offset = start
+            while offset < end:
+                line = file.readline()
+                offset += len(line)
+                if not line.strip():
+                    continue
+                row = next(csv.reader([line.decode()]))
+                yield int(row[site_column]), float(row[coherence_column]), float(row[variance_column]), row[category_column]
+
+
+def iter_branch_records(file_paths, branch):
+    """
+    Yields the rows of one branch from several components files (one per rate category), merged in site order.
+
+    Only one row per file is held in memory at a time.
+
+    Args:
+        file_paths (list of str): Paths to the components files.
+        branch (str): Branch label.
+
+    Yields:
+        tuple: Site, coherence, category variance and rate category of each row.
+
+    Raises:
+        ValueError: If the rows of the branch in a file are not ordered by site.
+    """
+    previous_site = None
+    merged_records = heapq.merge(*(iter_branch_records_of_file(path, branch) for path in file_paths), key=lambda record: record[0])
+    for record in merged_records:
+        if previous_site is not None and record[0] < previous_site:
+            raise ValueError(f"Rows of branch {branch} are not ordered by site.")
+        previous_site = record[0]
+        yield record
+
+
+""" Compact schema for component data """
+
+# Columns stored as categorical codes backed by a shared dictionary (e.g. the branch dictionary)
+COMPONENTS_CATEGORICAL_COLUMNS = ["branch", "rate_category", "dataset"]
+
+
+def get_memory_usage_mb(data_frames):
+    return sum(data.memory_usage(deep=True).sum() for data in data_frames) / 1024**2
+
+
+def build_categorical_dtype(data_frames, column):
+    """
+    Builds a categorical dtype from the sorted union of the values of a column in all data frames.
+
+    Sorting the categories keeps sorting by codes identical to sorting by the labels.
+
+    Args:
+        data_frames (list of DataFrame): Data frames containing the column.
+        column (str): Name of the column.
+
+    Returns:
+        CategoricalDtype: The dictionary of the column.
+    """
+    values = set()
+    for data in data_frames:
+        if column in data.columns:
+            values.update(data[column].dropna().unique())
+    return pd.CategoricalDtype(sorted(values))
+
+
+def compact_component_data(data_frames, float32_coherence=False):
+    """
+    Converts component data frames to the compact schema.
+
+    Branch, rate category and dataset become categorical columns sharing one dictionary
+    over all data frames, sites are stored as int32 and, optionally, coherence values as float32.
+
+    Args:
+        data_frames (list of DataFrame): Component data frames.
+        float32_coherence (bool, optional): Store the coherence column as float32. Default is False.
+
+    Returns:
+        list of DataFrame: The component data frames using the compact schema.
+    """
+    categorical_dtypes = {
+        column: build_categorical_dtype(data_frames, column) for column in COMPONENTS_CATEGORICAL_COLUMNS
+    }
+
+    compact_frames = []
+    for data in data_frames:
+        column_dtypes = {column: dtype for column, dtype in categorical_dtypes.items() if column in data.columns}
+        if "site" in data.columns:
+            column_dtypes["site"] = "int32"
+        if float32_coherence and "coherence" in data.columns:
+            column_dtypes["coherence"] = "float32"
+        compact_frames.append(data.astype(column_dtypes))
+    return compact_frames
+
+
+def concat_component_data(data_frames, float32_coherence=False, **kwargs):
+    # Align the dictionaries first, otherwise pd.concat falls back to object columns
+    return concat_data_frames(compact_component_data(data_frames, float32_coherence), **kwargs)
+
+
+def summarize_components_categories(directory_path, dataset_name, use_cache=True, max_workers=None, compact=True, float32_coherence=False, edge_list=None, file_names=None):
+    # Get a list of satute components files and read them (or their binary caches) concurrently
+    file_paths = list_satute_files(directory_path, ".components.csv", file_names)
+    if edge_list is not None:
+        # Only parse the rows of the considered branches
+        reader = lambda path: read_components_csv_for_branches(path, edge_list)
+    else:
+        reader = lambda path: read_components_csv(path, use_cache)
+    all_data = read_files_concurrently(file_paths, reader, max_workers)
+
+    component_data = []
+    for data in all_data:
         #filtered_data = data[data['test_statistic'] != 'duplicate sequence']
         
         filtered_data = data 
         if not filtered_data.empty:
             # Add dataset name
             filtered_data.loc[:, 'dataset'] = dataset_name
-            component_data = pd.concat([component_data, filtered_data])
+            component_data.append(filtered_data)
+
+    if not compact or not component_data:
+        return concat_data_frames(component_data)
+
+    memory_before = get_memory_usage_mb(component_data)
+    component_data = concat_component_data(component_data, float32_coherence)
+    print(f"Memory usage of component data: {memory_before:.2f} MB -> {get_memory_usage_mb([component_data]):.2f} MB")
 
     return component_data
 
+""" Streaming per-branch reader for components files """
+
+def iter_branch_blocks_of_file(file_path, chunksize=100000):
+    """
+    Yields the rows of a components file one branch at a time.
+
+    The file is read in chunks, so only the rows of the current branch are kept in memory.
+    Rows of a branch split over two chunks are joined before the branch is yielded.
+
+    Args:
+        file_path (str): Path to the components file.
+        chunksize (int, optional): Number of rows parsed at once. Default is 100000.
+
+    Yields:
+        tuple: The branch label and a DataFrame with the consecutive rows of that branch.
+    """
+    current_branch = None
+    current_blocks = []
+    for chunk in pd.read_csv(file_path, dtype=COMPONENTS_DTYPES, chunksize=chunksize):
+        branches = chunk['branch'].to_numpy()
+        block_starts = np.flatnonzero(np.r_[True, branches[1:] != branches[:-1]])
+        block_ends = np.r_[block_starts[1:], len(chunk)]
+
+        for start, end in zip(block_starts, block_ends):
+            branch = branches[start]
+            if branch != current_branch and current_blocks:
+                yield current_branch, pd.concat(current_blocks)
+                current_blocks = []
+            current_branch = branch
+            current_blocks.append(chunk.iloc[start:end])
+
+    if current_blocks:
+        yield current_branch, pd.concat(current_blocks)
+
+
+def iter_components_branches(directory_path, dataset_name, chunksize=100000, float32_coherence=False):
+    """
+    Yields the component data of a SatuTe output directory one branch at a time.
+
+    The blocks of a branch are merged over all per-category components files and sorted by site,
+    giving the same rows as the corresponding part of summarize_components_categories.
+    The files are read in lockstep. The branches of every file are looked up in its branch
+    offset index, and a branch is only yielded once no file still has it ahead of its current
+    branch, so a branch missing from single categories is still merged over all files.
+
+    Args:
+        directory_path (str): Directory containing the .components.csv files.
+        dataset_name (str): Name stored in the 'dataset' column.
+        chunksize (int, optional): Number of rows parsed at once per file. Default is 100000.
+        float32_coherence (bool, optional): Store the coherence column as float32. Default is False.
+
+    Yields:
+        tuple: The branch label and the component data of this branch.
+
+    Raises:
+        ValueError: If a branch shows up again after it was completed in the files, or if the
+            files list their branches in conflicting orders.
+    """
+    file_paths = list_satute_files(directory_path, ".components.csv")
+    readers = [iter_branch_blocks_of_file(file_path, chunksize) for file_path in file_paths]
+    heads = [next(reader, None) for reader in readers]
+    # Branches every file has not been read past yet
+    pending_branches = [set(load_branch_offset_index(file_path)) for file_path in file_paths]
+    completed_branches = set()
+
+    while any(head is not None for head in heads):
+        # Next branch is the first head that no other file still has further ahead
+        branch = next((
+            head[0] for head in heads
+            if head is not None and all(
+                head[0] not in pending or (other_head is not None and other_head[0] == head[0])
+                for pending, other_head in zip(pending_branches, heads)
+            )
+        ), None)
+        if branch is None:
+            raise ValueError(f"Components files in {directory_path} list their branches in conflicting orders")
+        if branch in completed_branches:
+            raise ValueError(f"Components files in {directory_path} are not grouped consistently by branch: {branch}")
+        completed_branches.add(branch)
+
+        branch_blocks = []
+        for index, head in enumerate(heads):
+            if head is not None and head[0] == branch:
+                branch_blocks.append(head[1])
+                pending_branches[index].discard(branch)
+                heads[index] = next(readers[index], None)
+
+        branch_data = pd.concat(branch_blocks)
+        branch_data.loc[:, 'dataset'] = dataset_name
+        branch_data = compact_component_data([branch_data], float32_coherence)[0]
+        branch_data.sort_values(by="site", inplace=True)
+        yield branch, branch_data
+
 def process_gene_directory(directory_path, dataset_name,newick_string):
 
     # Data frame to store the summarized results for saturation over all categories
@@ -371,10 +932,12 @@ def process_gene_directory_z_scores(directory_path, dataset_name, newick_string=
         
     return summarized_z_score_data
 
-def process_gene_directory_components(directory_path, dataset_name, newick_string=None):
+def process_gene_directory_components(directory_path, dataset_name, newick_string=None, use_cache=True, max_workers=None, compact=True, float32_coherence=False, edge_list=None):
 
     # Data frame to store data over all categories
-    summarized_data = summarize_components_categories(directory_path, dataset_name)
+    summarized_data = summarize_components_categories(
+        directory_path, dataset_name, use_cache, max_workers, compact, float32_coherence, edge_list
+    )
     
     # if not summarized_data.empty:  
     #     # Save data
@@ -1,4 +1,6 @@
 import pandas as pd
+import numpy as np
+import json
 import sys
 import os
 
@@ -7,60 +9,307 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 
 from utils.script_handle_data import (
-    process_gene_directory_components
+    concat_component_data,
+    get_content_hashes,
+    get_file_signature,
+    get_files_state,
+    iter_components_branches,
 )
 
+from utils.script_satute_run import (
+    get_satute_run,
+)
+
+
+# Suffixes of the folders written by the analyses, never datasets
+GENERATED_DIRECTORY_SUFFIXES = ("_summary_snapshots", ".pyramid")
+
+
+def get_dataset_directories(results_dir):
+    """
+    Lists the datasets of a SatuTe results directory: every subfolder, then results_dir itself.
+
+    Folders written by the analyses (see GENERATED_DIRECTORY_SUFFIXES) are skipped, so results_dir
+    can also be the output directory.
+
+    Args:
+        results_dir (str): Directory with the SatuTe output, optionally one subfolder per dataset.
+
+    Returns:
+        list of tuple: Dataset name and directory of every dataset.
+    """
+    subdirs = [
+        d for d in os.listdir(results_dir)
+        if os.path.isdir(os.path.join(results_dir, d)) and not d.endswith(GENERATED_DIRECTORY_SUFFIXES)
+    ]
+    directories = [(dataset_name, os.path.join(results_dir, dataset_name)) for dataset_name in subdirs]
+    directories.append((os.path.basename(results_dir), results_dir))
+    return directories
+
+
+def write_summarized_component_data(summarized_component_data, output_dir, data_name, float32_coherence=False):
+    # Aggregate all DataFrames into a single DataFrame
+    all_components_data = concat_component_data(
+        list(summarized_component_data.values()), float32_coherence, ignore_index=True
+    )
+
+    # Save the aggregated data
+    csv_file_path = os.path.join(output_dir, f"{data_name}_summarized_component_data.csv")
+    all_components_data.to_csv(csv_file_path, index=False)
+
+
+""" Manifest of the ingested SatuTe output """
+
+def get_summary_manifest_path(output_dir, data_name):
+    return os.path.join(output_dir, f"{data_name}_summary_manifest.json")
+
+
+def get_dataset_snapshot_path(output_dir, data_name, dataset_name):
+    return os.path.join(output_dir, f"{data_name}{GENERATED_DIRECTORY_SUFFIXES[0]}", f"{dataset_name}.npz")
+
+
+def get_source_files_state(directory_path, previous_files=None):
+    """
+    Records size, modification time and content hash of the components files of a directory.
+
+    The hash of a file is taken over from previous_files if its size and modification time are unchanged.
+
+    Args:
+        directory_path (str): Directory containing the .components.csv files.
+        previous_files (dict, optional): The state of the files from an earlier run.
+
+    Returns:
+        dict: File name to {"size", "mtime_ns", "sha256"}.
+    """
+    file_names = sorted(f for f in os.listdir(directory_path) if f.endswith(".components.csv"))
+    return get_files_state(directory_path, file_names, previous_files)
+
+
+def read_summary_manifest(manifest_path):
+    try:
+        with open(manifest_path, "r") as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_summary_manifest(manifest, manifest_path):
+    temporary_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(temporary_path, manifest_path)
+
+
+def write_dataset_snapshot(data, snapshot_path):
+    """
+    Stores the summarized component data of one dataset, including its index and categorical dictionaries.
+
+    Args:
+        data (DataFrame): Component data of the dataset in the compact schema.
+        snapshot_path (str): Path to the .npz file.
+    """
+    arrays = {
+        "__index": data.index.to_numpy(),
+        "__columns": np.array(data.columns.tolist(), dtype=str),
+    }
+    for column in data.columns:
+        if isinstance(data[column].dtype, pd.CategoricalDtype):
+            arrays[f"{column}__codes"] = data[column].cat.codes.to_numpy()
+            arrays[f"{column}__categories"] = np.array(data[column].cat.categories, dtype=str)
+        else:
+            arrays[column] = data[column].to_numpy()
+
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    temporary_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as snapshot_file:
+        np.savez(snapshot_file, **arrays)
+    os.replace(temporary_path, snapshot_path)
+
+
+def read_dataset_snapshot(snapshot_path):
+    """
+    Loads the summarized component data of one dataset stored by write_dataset_snapshot.
+
+    Args:
+        snapshot_path (str): Path to the .npz file.
 
-def summarize_component_data(results_dir, output_dir, data_name=None):
+    Returns:
+        DataFrame or None: The component data, or None if the snapshot is missing or unreadable.
+    """
+    try:
+        with np.load(snapshot_path, allow_pickle=False) as snapshot:
+            columns = {}
+            for column in snapshot["__columns"].tolist():
+                if f"{column}__codes" in snapshot.files:
+                    columns[column] = pd.Categorical.from_codes(
+                        snapshot[f"{column}__codes"], categories=snapshot[f"{column}__categories"].tolist()
+                    )
+                else:
+                    columns[column] = snapshot[column]
+            return pd.DataFrame(columns, index=snapshot["__index"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def summarize_component_data(results_dir, output_dir, data_name=None, float32_coherence=False, edge_list=None, incremental=False):
+    """
+    Summarizes the component data of every dataset (subfolder) of results_dir and of results_dir itself.
+
+    With incremental, a manifest in output_dir records the content hash of every ingested components
+    file and the size and modification time of the summary CSV, and the data of each dataset is kept
+    as a snapshot. On later runs only new or changed datasets are read again, and the summary CSV is only
+    rewritten if a dataset changed. If the CSV was written by another run since, e.g. by
+    stream_component_data, everything is read again.
+
+    Args:
+        results_dir (str): Directory with the SatuTe output, optionally one subfolder per dataset.
+        output_dir (str): Directory where the summarized component data is saved.
+        data_name (str, optional): Name of the summary file. If None, the name of results_dir is used.
+        float32_coherence (bool, optional): Store the coherence column as float32. Default is False.
+        edge_list (list, optional): List of branches to include. If None, include all branches.
+        incremental (bool, optional): Reuse the data of unchanged datasets from an earlier run. Default is False.
+
+    Returns:
+        dict: Dataset name to its component data, sorted by branch and site.
+    """
     if data_name is None: 
         data_name = os.path.basename(results_dir)
 
     summarized_component_data = {}
 
     print("Summarize coherence coefficient data:")
-    
-    # List all subdirectories in the results_dir
-    subdirs = [d for d in os.listdir(results_dir) if os.path.isdir(os.path.join(results_dir, d))]
-
-    if subdirs:  # If there are subdirectories, process each one
-        for dataset_name in subdirs:
-            print(f"Processing subfolder: {dataset_name}")
-            gene_directory = os.path.join(results_dir, dataset_name)
-            
+
+    csv_file_path = os.path.join(output_dir, f"{data_name}_summarized_component_data.csv")
+    manifest_path = get_summary_manifest_path(output_dir, data_name)
+    settings = {
+        "edge_list": None if edge_list is None else sorted(edge_list),
+        "float32_coherence": float32_coherence,
+    }
+    previous_manifest = read_summary_manifest(manifest_path) if incremental else None
+    if (
+        previous_manifest is None
+        or previous_manifest.get("settings") != settings
+        or not os.path.isfile(csv_file_path)
+        or previous_manifest.get("summary") != list(get_file_signature(csv_file_path))
+    ):
+        # Everything has to be read again
+        previous_manifest = {"datasets": {}}
+    manifest = {"settings": settings, "datasets": {}}
+    changed = False
+
+    # All subdirectories in the results_dir, processed before the results_dir itself
+    for dataset_name, gene_directory in get_dataset_directories(results_dir):
+        print(f"Processing: {gene_directory}")
+        previous = previous_manifest["datasets"].get(dataset_name)
+        files = get_source_files_state(gene_directory, previous["files"] if previous else None) if incremental else {}
+        snapshot_path = get_dataset_snapshot_path(output_dir, data_name, dataset_name)
+
+        gene_component_data = None
+        if previous is not None and get_content_hashes(previous["files"]) == get_content_hashes(files):
+            if not previous["has_data"]:
+                gene_component_data = pd.DataFrame()
+            else:
+                gene_component_data = read_dataset_snapshot(snapshot_path)
+
+        if gene_component_data is None:
+            changed = True
             # Analysis summary for specific gene directory
-            gene_component_data = process_gene_directory_components(gene_directory, dataset_name)
-            
+            # Sorted by branch and site, and not kept by the run, the summary holds the only copy
+            gene_component_data = get_satute_run(gene_directory).get_component_data(
+                dataset_name, edge_list=edge_list, float32_coherence=float32_coherence, memoize=False
+            )
             if not gene_component_data.empty:
-                # Sort the data by the "site" column and append to the summarized data
-                gene_component_data.sort_values(by=["branch", "site"], inplace=True)
-                summarized_component_data[dataset_name] = gene_component_data
-
-    
-    # If there are no subdirectories, process the results_dir itself
-    print(f"Processing: {results_dir}")
-    gene_component_data = process_gene_directory_components(results_dir, os.path.basename(results_dir))
-    
-    if not gene_component_data.empty:
-        gene_component_data.sort_values(by=["branch", "site"], inplace=True)
-        summarized_component_data[os.path.basename(results_dir)] = gene_component_data
-
-    if summarized_component_data:  # Checking if the dictionary is not empty
-        # Aggregate all DataFrames into a single DataFrame
-        all_components_data = pd.concat(summarized_component_data.values(), ignore_index=True)
-        
-        # Save the aggregated data
-        csv_file_path = os.path.join(output_dir, f"{data_name}_summarized_component_data.csv")
-        all_components_data.to_csv(csv_file_path, index=False)
+                if incremental:
+                    write_dataset_snapshot(gene_component_data, snapshot_path)
+        else:
+            print("Unchanged since the last summary")
+
+        manifest["datasets"][dataset_name] = {"files": files, "has_data": not gene_component_data.empty}
+        if not gene_component_data.empty:
+            summarized_component_data[dataset_name] = gene_component_data
+
+    # Datasets removed since the last summary
+    changed = changed or set(previous_manifest["datasets"]) != set(manifest["datasets"])
+
+    if summarized_component_data and changed:
+        write_summarized_component_data(summarized_component_data, output_dir, data_name, float32_coherence)
+
+    if incremental and os.path.isfile(csv_file_path):
+        # The summary CSV the snapshots belong to
+        manifest["summary"] = list(get_file_signature(csv_file_path))
+        write_summary_manifest(manifest, manifest_path)
 
     print("")
     return summarized_component_data
 
 
+def iter_branch_data(summarized_component_data, edge_list=None):
+    """
+    Yields the component data of every branch of summarized component data.
+
+    Args:
+        summarized_component_data (dict): Dataset name to component data, as returned by summarize_component_data.
+        edge_list (list, optional): List of branches to include. If None, include all branches.
+
+    Yields:
+        tuple: Dataset name, branch label and the component data of this branch.
+    """
+    for dataset, component_data in summarized_component_data.items():
+        for branch in component_data['branch'].unique():
+            if edge_list is None or branch in edge_list:
+                yield dataset, branch, component_data[component_data['branch'] == branch]
+
+
+def stream_component_data(results_dir, output_dir, data_name=None, edge_list=None, float32_coherence=False):
+    """
+    Streaming counterpart of summarize_component_data, holding only one branch in memory at a time.
+
+    The summarized component data CSV is written incrementally. Its rows are grouped by dataset
+    and branch as in summarize_component_data, but the branches keep the order of the SatuTe files.
+
+    Args:
+        results_dir (str): Directory with the SatuTe output, optionally one subfolder per dataset.
+        output_dir (str): Directory where the summarized component data is saved.
+        data_name (str, optional): Name of the summary file. If None, the name of results_dir is used.
+        edge_list (list, optional): List of branches to write and yield. If None, all branches.
+        float32_coherence (bool, optional): Store the coherence column as float32. Default is False.
+
+    Yields:
+        tuple: Dataset name, branch label and the component data of this branch.
+    """
+    if data_name is None: 
+        data_name = os.path.basename(results_dir)
+
+    print("Stream coherence coefficient data:")
+
+    # Subfolders first, the results_dir itself last, as in summarize_component_data
+    directories = get_dataset_directories(results_dir)
+
+    csv_file_path = os.path.join(output_dir, f"{data_name}_summarized_component_data.csv")
+    write_header = True
+
+    for dataset_name, directory in directories:
+        print(f"Processing: {directory}")
+        for branch, branch_data in iter_components_branches(directory, dataset_name, float32_coherence=float32_coherence):
+            # Only the selected branches, as in summarize_component_data
+            if edge_list is not None and branch not in edge_list:
+                continue
+
+            branch_data.to_csv(csv_file_path, index=False, header=write_header, mode="w" if write_header else "a")
+            write_header = False
+
+            yield dataset_name, branch, branch_data
+
+    print("")
+
+
 def calculate_variance(component_dataframe):
     variance = 0
     rate_counts = component_dataframe['rate_category'].value_counts()
+    # Categorical rate categories also report the categories absent from this data
+    rate_counts = rate_counts[rate_counts > 0]
     sequence_len = sum(rate_counts)
-    variance_by_rate = component_dataframe.groupby('rate_category')['category_variance'].first()
+    variance_by_rate = component_dataframe.groupby('rate_category', observed=True)['category_variance'].first()
     for rate, count in rate_counts.items():
         variance += variance_by_rate[rate] * count/sequence_len
     return variance
\ No newline at end of file
@@ -0,0 +1,162 @@
+import os
+import re
+import io
+import pandas as pd
+from functools import lru_cache
+
+
+CATEGORY_SITES_PATTERN = re.compile(r"(\S+), Site per category (\d+)")
+
+
+def get_report_key(file_path):
+    # Parsed reports are cached per path, size and modification time
+    stat = os.stat(file_path)
+    return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+
+
+def parse_category_rate_table(table_lines):
+    """
+    Converts the lines of the rate category table of a .satute file into a DataFrame.
+
+    Args:
+        table_lines (list of str): Non-empty lines of the table without the header.
+
+    Returns:
+        DataFrame: Columns "Category" (named c1, c2, ...) and "Relative_rate".
+    """
+    columns = [
+        "Category",
+        "Relative_rate",
+        "Proportion",
+        "Empirical_Proportion"
+    ]
+    df = pd.read_csv(io.StringIO('\n'.join(table_lines)), sep=r"\s+", names=columns)
+
+    # Select only the first two columns
+    df = df[["Category", "Relative_rate"]]
+
+    # Rename the Category column to c1, c2, ...
+    df["Category"] = ['c{}'.format(i + 1) for i in range(len(df))]
+    return df
+
+
+class NewickScanner:
+    """
+    Finds the first Newick string after "tree:" in a stream of lines.
+
+    Mirrors the search of get_newick_string_from_satute: the first '(' after "tree:"
+    up to the first ';' after it, possibly spanning several lines.
+    """
+
+    def __init__(self):
+        self.state = "tree"
+        self.parts = []
+        self.newick_string = ""
+
+    def feed(self, line):
+        if self.state == "tree":
+            position = line.find("tree:")
+            if position == -1:
+                return
+            self.state = "start"
+            line = line[position + len("tree:"):]
+
+        if self.state == "start":
+            position = line.find("(")
+            if position == -1:
+                return
+            self.state = "end"
+            line = line[position:]
+
+        if self.state == "end":
+            position = line.find(";")
+            if position == -1:
+                self.parts.append(line)
+                return
+            self.parts.append(line[:position + 1])
+            self.newick_string = "".join(self.parts)
+            self.state = "done"
+
+
+@lru_cache(maxsize=None)
+def parse_satute_report_cached(file_path, file_size, file_mtime_ns):
+    table_found = False
+    table_done = False
+    table_lines = []
+    newick_scanner = NewickScanner()
+    spectral_start = None
+    spectral_end = None
+
+    with open(file_path, 'r') as file:
+        for line_number, line in enumerate(file):
+            newick_scanner.feed(line)
+
+            if "Category" in line and "Relative_rate" in line:
+                table_found = True
+                continue
+
+            if "SPECTRAL DECOMPOSITION" in line:
+                # The rate category table ends with the spectral decomposition section
+                table_done = table_done or table_found
+            if "SPECTRAL DECOMPOSITION" in line and spectral_start is None:
+                spectral_start = line_number
+            elif spectral_start is not None and spectral_end is None and line.startswith("####"):
+                spectral_end = line_number
+
+            if table_found and not table_done and line.strip() != "":
+                table_lines.append(line.strip())
+
+    if spectral_start is not None and spectral_end is None:
+        spectral_end = line_number + 1
+
+    return {
+        "category_rates": parse_category_rate_table(table_lines) if table_found else None,
+        "newick_string": newick_scanner.newick_string,
+        "spectral_decomposition": None if spectral_start is None else (spectral_start, spectral_end),
+    }
+
+
+def parse_satute_report(file_path):
+    """
+    Parses a .satute report in a single pass over the file.
+
+    Results are cached per file, a modified file is parsed again.
+
+    Args:
+        file_path (str): Path to the .satute file.
+
+    Returns:
+        dict:
+            - "category_rates": DataFrame with the columns "Category" and "Relative_rate",
+              or None if the report has no rate category table.
+            - "newick_string": The Newick string of the tree, or an empty string.
+            - "spectral_decomposition": Line range [start, end) of the SPECTRAL DECOMPOSITION
+              section, or None if the report has no such section.
+    """
+    return parse_satute_report_cached(*get_report_key(file_path))
+
+
+@lru_cache(maxsize=None)
+def parse_satute_log_cached(file_path, file_size, file_mtime_ns):
+    sites_per_category = {}
+    with open(file_path, 'r') as file:
+        for line in file:
+            for category, seq_len in CATEGORY_SITES_PATTERN.findall(line):
+                sites_per_category.setdefault(category, int(seq_len))
+    return {"sites_per_category": sites_per_category}
+
+
+def parse_satute_log(file_path):
+    """
+    Parses a .satute.log file in a single pass over the file.
+
+    Results are cached per file, a modified file is parsed again.
+
+    Args:
+        file_path (str): Path to the .satute.log file.
+
+    Returns:
+        dict:
+            - "sites_per_category": Rate category to the number of sites in this category.
+    """
+    return parse_satute_log_cached(*get_report_key(file_path))
@@ -4,6 +4,8 @@ from pandas import DataFrame
 import re
 import os
 
+from utils.script_handle_satute_report import parse_satute_report
+
 def convert_tree_to_newick_string(tree_obj):
     """
     Converts a Tree object back into a Newick string.
@@ -178,19 +180,8 @@ def get_newick_string_from_satute(file_path):
     newick_string = ""
 
     try:
-        with open(file_path, 'r') as file:
-            content = file.read()
-
-            # Find the position of "tree:"
-            tree_pos = content.find("tree:")
-            if tree_pos != -1:
-                # Find the start of the Newick string (first '(' after "tree:")
-                start_pos = content.find("(", tree_pos)
-                # Find the end of the Newick string (first ';' after start_pos)
-                end_pos = content.find(";", start_pos)
-                
-                if start_pos != -1 and end_pos != -1:
-                    newick_string = content[start_pos:end_pos+1]
+        # Single pass over the report, cached per file
+        newick_string = parse_satute_report(file_path)["newick_string"]
 
     except FileNotFoundError:
         print(f"File not found: {file_path}")
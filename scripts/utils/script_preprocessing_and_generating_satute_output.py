@@ -37,9 +37,11 @@ def generate_edge_directories(edge_list, output_dir, source_folder=None, fasta_f
 
 def  run_satute_for_edge(edge_name, tree_file, folder_path, path_iqtree, alpha,model):
     # Run Satute using  alignment and tree
-    log_file = find_file_with_suffix_in_directory("satute.log", folder_path)
+    # One scan of the folder for both files
+    file_names = os.listdir(folder_path)
+    log_file = find_file_with_suffix_in_directory("satute.log", folder_path, file_names)
     if not log_file:
-        fasta_file_aln = find_file_with_suffix_in_directory(".fasta", folder_path)
+        fasta_file_aln = find_file_with_suffix_in_directory(".fasta", folder_path, file_names)
         arguments = [
                 "satute",
                 "-iqtree",
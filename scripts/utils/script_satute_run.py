@@ -0,0 +1,297 @@
+import os
+import re
+from collections import OrderedDict
+from functools import cached_property
+
+from utils.script_handle_data import (
+    build_categories_by_sub_tables,
+    extract_relative_category_rates_from_satute,
+    parse_file_to_data_frame,
+    summarize_components_categories,
+    summarize_saturated_results_categories,
+    summarize_z_scores_categories,
+)
+
+from utils.script_handle_tree import (
+    extract_newick_from_nexus,
+    get_newick_string_from_satute,
+    remove_metadata_from_newick,
+)
+
+
+# Artifact kinds and their file suffixes, more specific suffixes first
+SATUTE_ARTIFACT_SUFFIXES = [
+    ("components", ".satute.components.csv"),
+    ("results", ".satute.csv"),
+    ("nexus", ".satute.nex"),
+    ("log", ".satute.log"),
+    ("report", ".satute"),
+    ("tree", "satute_tree.tree"),
+    ("siteprob", ".siteprob"),
+    ("treefile", ".treefile"),
+]
+
+# Per-category files are named <alignment>_<category>_<alpha>.satute...
+RATE_CATEGORY_PATTERN = re.compile(r"_(c\d+|single_rate)_[^_]+$")
+
+
+def classify_satute_file(file_name):
+    for kind, suffix in SATUTE_ARTIFACT_SUFFIXES:
+        if file_name.endswith(suffix):
+            return kind
+    return None
+
+
+def get_rate_category_from_file_name(file_name):
+    """
+    Extracts the rate category (e.g. "c1" or "single_rate") from the name of a per-category SatuTe file.
+
+    Args:
+        file_name (str): Name of the file.
+
+    Returns:
+        str: The rate category, or the file name without the SatuTe suffix if it does not follow the naming scheme.
+    """
+    stem = file_name.split(".satute")[0]
+    match = RATE_CATEGORY_PATTERN.search(stem)
+    return match.group(1) if match else stem
+
+
+class SatuteRun:
+    """
+    All artifacts of one SatuTe output directory.
+
+    The directory and its iqtree/ subfolder are scanned once when the object is created and
+    every file is classified by its suffix. Parsed artifacts are loaded on first access and
+    kept, so analyses working on the same directory share them. Use get_satute_run to share
+    the object itself within a process, and find_file / find_files instead of scanning the
+    directory again.
+
+    Args:
+        directory_path (str): The SatuTe output directory.
+        file_names (list, optional): Names of the files of the directory, if already scanned.
+        iqtree_file_names (list, optional): Names of the files of the iqtree/ subfolder, if already scanned.
+    """
+
+    def __init__(self, directory_path, file_names=None, iqtree_file_names=None):
+        self.directory_path = directory_path
+        self.name = os.path.basename(os.path.normpath(directory_path))
+        if file_names is None:
+            file_names, iqtree_file_names = scan_satute_directory(directory_path)
+        self.file_names = file_names
+        self.artifacts = self.classify_files(directory_path, self.file_names)
+
+        iqtree_dir = os.path.join(directory_path, "iqtree")
+        self.iqtree_artifacts = self.classify_files(iqtree_dir, iqtree_file_names or [])
+
+        self.memo = {}
+
+    @staticmethod
+    def classify_files(directory_path, file_names):
+        artifacts = {}
+        for file_name in file_names:
+            kind = classify_satute_file(file_name)
+            if kind is not None:
+                artifacts.setdefault(kind, []).append(os.path.join(directory_path, file_name))
+        return artifacts
+
+    def get_files(self, kind):
+        return self.artifacts.get(kind, [])
+
+    def get_file(self, kind, search_iqtree=False):
+        """
+        Returns the first file of a kind, optionally also looking in the iqtree/ subfolder.
+
+        Args:
+            kind (str): Artifact kind, see SATUTE_ARTIFACT_SUFFIXES.
+            search_iqtree (bool, optional): Look in the iqtree/ subfolder if the directory has no such file.
+
+        Returns:
+            str or None: Path to the file, or None if there is none.
+        """
+        files = self.get_files(kind)
+        if not files and search_iqtree:
+            files = self.iqtree_artifacts.get(kind, [])
+        return files[0] if files else None
+
+    def get_files_per_category(self, kind):
+        return {get_rate_category_from_file_name(os.path.basename(f)): f for f in self.get_files(kind)}
+
+    def find_files(self, suffix):
+        # Any file of the directory by its suffix, from the scan of the directory
+        return [os.path.join(self.directory_path, f) for f in self.file_names if f.endswith(suffix)]
+
+    def find_file(self, suffix):
+        files = self.find_files(suffix)
+        return files[0] if files else None
+
+    """ Files """
+
+    @property
+    def report_file(self):
+        return self.get_file("report")
+
+    @property
+    def log_file(self):
+        return self.get_file("log")
+
+    @property
+    def components_files(self):
+        return self.get_files_per_category("components")
+
+    @property
+    def results_files(self):
+        return self.get_files_per_category("results")
+
+    @property
+    def nexus_files(self):
+        return self.get_files_per_category("nexus")
+
+    @property
+    def siteprob_file(self):
+        return self.get_file("siteprob", search_iqtree=True)
+
+    @property
+    def treefile(self):
+        return self.get_file("treefile", search_iqtree=True)
+
+    @property
+    def tree_file(self):
+        # Same preference as get_tree_file: the SatuTe tree, else the first nexus file
+        return self.get_file("tree") or self.get_file("nexus")
+
+    """ Parsed artifacts """
+
+    @cached_property
+    def category_rates(self):
+        return extract_relative_category_rates_from_satute(self.report_file)
+
+    @cached_property
+    def newick_string(self):
+        return get_newick_string_from_satute(self.report_file)
+
+    @cached_property
+    def plain_newick_string(self):
+        return remove_metadata_from_newick(extract_newick_from_nexus(self.get_file("nexus")))
+
+    @cached_property
+    def sites_per_category(self):
+        site_probability = parse_file_to_data_frame(self.siteprob_file)
+        return build_categories_by_sub_tables(site_probability)
+
+    def get_component_data(self, dataset_name=None, edge_list=None, float32_coherence=False, memoize=True):
+        """
+        Returns the component data of all rate categories sorted by branch and site, see summarize_components_categories.
+
+        With memoize, the result is kept per set of arguments and shared by all callers, which must not
+        modify it. Callers that keep the data themselves, e.g. summarize_component_data, pass
+        memoize=False so that it is released together with their copy.
+        """
+        dataset_name = self.name if dataset_name is None else dataset_name
+        key = ("components", dataset_name, None if edge_list is None else tuple(edge_list), float32_coherence)
+        if key in self.memo:
+            return self.memo[key]
+
+        component_data = summarize_components_categories(
+            self.directory_path, dataset_name,
+            float32_coherence=float32_coherence, edge_list=edge_list, file_names=self.file_names,
+        )
+        if not component_data.empty:
+            # Sorted once here, the unsorted data is released right away
+            component_data = component_data.sort_values(by=["branch", "site"])
+        if memoize:
+            self.memo[key] = component_data
+        return component_data
+
+    def get_zscore_data(self, dataset_name=None):
+        """
+        Returns the z-scores of all rate categories, see summarize_z_scores_categories.
+
+        The result is memoized per dataset name and shared by all callers, which must not modify it.
+        """
+        dataset_name = self.name if dataset_name is None else dataset_name
+        key = ("zscores", dataset_name)
+        if key not in self.memo:
+            self.memo[key] = summarize_z_scores_categories(self.directory_path, dataset_name, file_names=self.file_names)
+        return self.memo[key]
+
+    def get_saturated_results(self, dataset_name=None):
+        """
+        Returns the saturated branches of all rate categories, see summarize_saturated_results_categories.
+
+        The result is memoized per dataset name and shared by all callers, which must not modify it.
+        """
+        dataset_name = self.name if dataset_name is None else dataset_name
+        key = ("saturated", dataset_name)
+        if key not in self.memo:
+            self.memo[key] = summarize_saturated_results_categories(self.directory_path, dataset_name, file_names=self.file_names)
+        return self.memo[key]
+
+
+""" Shared runs within a process """
+
+# At most SATUTE_RUNS_LIMIT runs are kept, the least recently used is dropped first
+SATUTE_RUNS_LIMIT = 8
+
+satute_runs = OrderedDict()
+
+
+def scan_satute_directory(directory_path):
+    """
+    Lists the files of a SatuTe output directory and of its iqtree/ subfolder.
+
+    Args:
+        directory_path (str): The SatuTe output directory.
+
+    Returns:
+        tuple: The file names of the directory and of the iqtree/ subfolder (None if there is none).
+    """
+    file_names = os.listdir(directory_path)
+    iqtree_dir = os.path.join(directory_path, "iqtree")
+    iqtree_file_names = os.listdir(iqtree_dir) if os.path.isdir(iqtree_dir) else None
+    return file_names, iqtree_file_names
+
+
+def get_artifacts_state(directory_path, file_names, iqtree_file_names):
+    # Size and modification time of every SatuTe artifact, the files are not read
+    artifact_names = [f for f in file_names if classify_satute_file(f) is not None]
+    artifact_names += [os.path.join("iqtree", f) for f in iqtree_file_names or [] if classify_satute_file(f) is not None]
+    states = {}
+    for artifact_name in sorted(artifact_names):
+        stat = os.stat(os.path.join(directory_path, artifact_name))
+        states[artifact_name] = (stat.st_size, stat.st_mtime_ns)
+    return states
+
+
+def get_satute_run(directory_path):
+    """
+    Returns the shared SatuteRun of a directory.
+
+    The run is created again if a SatuTe artifact was added or removed, or if its size or
+    modification time changed. Only os.stat is called, the artifacts are read when the run loads them.
+
+    Args:
+        directory_path (str): The SatuTe output directory.
+
+    Returns:
+        SatuteRun: The run of the directory.
+    """
+    key = os.path.abspath(directory_path)
+    file_names, iqtree_file_names = scan_satute_directory(directory_path)
+    previous_files, satute_run = satute_runs.pop(key, ({}, None))
+    files = get_artifacts_state(directory_path, file_names, iqtree_file_names)
+
+    if satute_run is None or files != previous_files:
+        satute_run = SatuteRun(directory_path, file_names, iqtree_file_names)
+    else:
+        # Same artifacts, other files (e.g. caches) may have been added
+        satute_run.file_names = file_names
+
+    satute_runs[key] = (files, satute_run)
+    while len(satute_runs) > SATUTE_RUNS_LIMIT:
+        satute_runs.popitem(last=False)
+    return satute_run
+
+
+def clear_satute_runs():
+    satute_runs.clear()
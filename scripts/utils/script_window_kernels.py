@@ -0,0 +1,126 @@
+import numpy as np
+from functools import lru_cache
+
+
+""" Window kernels
+
+Each kernel maps a window size to the weights of the sites of a window, from the first
+(leftmost) to the last site. The weights do not need to be normalised.
+"""
+
+def uniform_kernel(window_size):
+    return np.ones(window_size)
+
+
+def linear_decreasing_kernel(window_size):
+    # The weighting of calculate_window_zscore
+    return np.linspace(1, 0.5, window_size)
+
+
+def triangular_kernel(window_size):
+    # Highest weight in the middle of the window, decreasing linearly towards both ends
+    positions = np.arange(window_size)
+    return np.minimum(positions + 1, window_size - positions).astype(np.float64)
+
+
+def gaussian_kernel(window_size):
+    # Standard deviation of a sixth of the window, the window covers +-3 standard deviations
+    positions = np.arange(window_size) - (window_size - 1) / 2
+    standard_deviation = max(window_size / 6, 1e-12)
+    return np.exp(-0.5 * (positions / standard_deviation) ** 2)
+
+
+def exponential_kernel(window_size):
+    # Decreasing from the first site like linear_decreasing, down to exp(-3) at the last site
+    if window_size == 1:
+        return np.ones(1)
+    return np.exp(-3 * np.arange(window_size) / (window_size - 1))
+
+
+WINDOW_KERNELS = {
+    "uniform": uniform_kernel,
+    "linear_decreasing": linear_decreasing_kernel,
+    "triangular": triangular_kernel,
+    "gaussian": gaussian_kernel,
+    "exponential": exponential_kernel,
+}
+
+# Windows larger than this are evaluated by FFT convolution
+FFT_WINDOW_THRESHOLD = 256
+
+
+def register_window_kernel(name, kernel_function):
+    """
+    Adds a window kernel to the registry.
+
+    Args:
+        name (str): Name of the kernel.
+        kernel_function (callable): Maps a window size to an array of window_size non-negative weights.
+    """
+    WINDOW_KERNELS[name] = kernel_function
+    get_window_kernel.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def get_window_kernel(kernel, window_size):
+    """
+    Returns the weights of a kernel and the effective number of sites of a window, computed once per (kernel, size).
+
+    The weighted mean of window_size independent values with variance s^2 has the variance
+    s^2 / effective_size with effective_size = sum(w)^2 / sum(w^2). For uniform weights this is window_size.
+
+    Args:
+        kernel (str): Name of the kernel, see WINDOW_KERNELS.
+        window_size (int): Number of sites per window.
+
+    Returns:
+        tuple: The weights (read-only np.ndarray) and the effective size (float).
+
+    Raises:
+        ValueError: If the kernel is not registered.
+    """
+    if kernel not in WINDOW_KERNELS:
+        raise ValueError(f"Unknown window kernel: {kernel}. Available kernels: {', '.join(WINDOW_KERNELS)}")
+
+    weights = np.asarray(WINDOW_KERNELS[kernel](window_size), dtype=np.float64)
+    weights.setflags(write=False)
+    effective_size = weights.sum() ** 2 / np.square(weights).sum()
+    return weights, effective_size
+
+
+def convolve_windows_fft(values, weights):
+    """
+    Computes the weighted sums of all complete windows along the last axis by FFT convolution.
+
+    Windows containing NaN are NaN, as with direct summation.
+
+    Args:
+        values (np.ndarray): Values, one track per row (or a single 1D track).
+        weights (np.ndarray): Weights of the sites of a window.
+
+    Returns:
+        np.ndarray: Weighted sum of every window, the last axis has len - window_size + 1 entries.
+    """
+    window_size = len(weights)
+    number_of_sites = values.shape[-1]
+    number_of_windows = number_of_sites - window_size + 1
+
+    missing = np.isnan(values)
+    filled_values = np.where(missing, 0.0, values)
+
+    # Zero padding to a power of two avoids the circular wrap-around
+    fft_size = 1 << int(np.ceil(np.log2(number_of_sites + window_size - 1)))
+    convolution = np.fft.irfft(
+        np.fft.rfft(filled_values, fft_size, axis=-1) * np.fft.rfft(weights[::-1], fft_size),
+        fft_size, axis=-1,
+    )
+    window_sums = convolution[..., window_size - 1:window_size - 1 + number_of_windows]
+
+    # Exact count of the missing values per window from prefix sums
+    missing_prefix = np.concatenate(
+        (np.zeros(missing.shape[:-1] + (1,), dtype=np.int64), np.cumsum(missing, axis=-1)), axis=-1
+    )
+    missing_per_window = missing_prefix[..., window_size:] - missing_prefix[..., :number_of_windows]
+    window_sums[missing_per_window > 0] = np.nan
+
+    return window_sums
@@ -1,5 +1,4 @@
 import pandas as pd
-import itertools
 import sys
 import os
 
@@ -19,32 +18,43 @@ from utils.script_handle_data import(
     subdictonary_additional_info
 )
 
-def calculate_all_pairwise_differences(region_zscores_df):
-    # Initialize a list to store the results
-    results = []
+def calculate_all_pairwise_differences(region_zscores_df, as_array=False):
+    """
+    Computes the z-score differences of all pairs of branches for every region.
 
-    # Extract the list of branch names (columns) excluding the 'region_name' column
-    branches = region_zscores_df.columns.difference(['region'])
+    The differences of all pairs are taken at once from the region x branch z-score matrix. The pairs
+    follow the upper triangle of the sorted branches, the order of itertools.combinations.
 
-    # Iterate over each region
-    for index, row in region_zscores_df.iterrows():
-        region = row['region']
-        
-        # Generate all pairwise combinations of branches
-        for branch_one, branch_two in itertools.combinations(branches, 2):
-            # Calculate the difference in z-scores between the two branches
-            zscore_difference = row[branch_one] - row[branch_two]
-            
-            # Append the result to the list
-            results.append({
-                'region': region,
-                'zscore_difference': zscore_difference,
-                'branch_one': branch_one,
-                'branch_two': branch_two
-            })
-
-    # Convert the list of results into a DataFrame
-    result_df = pd.DataFrame(results)
+    Args:
+        region_zscores_df (DataFrame): Region z-scores with a region column and one column per branch.
+        as_array (bool, optional): Return the differences as a region x branch x branch array instead,
+            the entry [r, i, j] being the z-score of branch i minus that of branch j in region r, with the
+            regions in row order and the branches sorted. Default is False.
+
+    Returns:
+        DataFrame: The columns region, zscore_difference, branch_one and branch_two, one row per region and
+        branch pair, ordered by region and pair. Or the array, if as_array.
+    """
+    # Extract the list of branch names (columns) excluding the 'region' column
+    branches = region_zscores_df.columns.difference(['region'])
+    zscores = region_zscores_df[branches].to_numpy(dtype=np.float64)
+
+    if as_array:
+        return zscores[:, :, np.newaxis] - zscores[:, np.newaxis, :]
+
+    # Pairs in the order of itertools.combinations(branches, 2)
+    first, second = np.triu_indices(len(branches), k=1)
+    if len(region_zscores_df) == 0 or len(first) == 0:
+        return pd.DataFrame(columns=['region', 'zscore_difference', 'branch_one', 'branch_two'])
+
+    number_of_regions = len(region_zscores_df)
+    branch_names = branches.to_numpy(dtype=object)
+    result_df = pd.DataFrame({
+        'region': np.repeat(region_zscores_df['region'].to_numpy(), len(first)),
+        'zscore_difference': (zscores[:, first] - zscores[:, second]).ravel(),
+        'branch_one': np.tile(branch_names[first], number_of_regions),
+        'branch_two': np.tile(branch_names[second], number_of_regions),
+    })
 
     return result_df
 